@@ -2,9 +2,11 @@ import streamlit as st
 import json
 import os
 from compliance_checker import ComplianceChecker
-from pdf_processor import PDFProcessor
+from sharded_store import create_processor, current_store_version
 from compliance_rules import get_all_rules
-from config import RESULTS_FILE
+from run_log import RunLog
+from instrumentation import METRICS, load_report
+from config import RESULTS_FILE, PDF_DIR
 
 # Page configuration
 st.set_page_config(
@@ -13,31 +15,87 @@ st.set_page_config(
     layout="wide"
 )
 
+def open_store():
+    """Create the sample documents and vector store if missing, returning a processor with the index loaded"""
+    # Initialize PDF processor (sharded when NUM_SHARDS > 1)
+    processor = create_processor()
+    
+    # Check if we have documents and vector store
+    if not os.path.exists(PDF_DIR) or not os.listdir(PDF_DIR):
+        processor.download_cuad_contracts()
+    
+    # Load or create vector store
+    processor.load_vector_store()
+    return processor
+
+@st.cache_resource(max_entries=1, show_spinner="Initializing compliance checking system...")
+def load_system(index_version):
+    """Build the processor, index and checker once per index version, shared by all sessions and reruns"""
+    # The checker searches through the same processor instead of loading its own copy
+    return ComplianceChecker(pdf_processor=open_store())
+
+@st.cache_data(max_entries=4)
+def load_results(path, mtime):
+    """Parsed results file, re-read only when its modification time changes"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
 def initialize_system():
     """Initialize the compliance checking system"""
     try:
-        with st.spinner("Initializing compliance checking system..."):
-            # Initialize PDF processor
-            processor = PDFProcessor()
-            
-            # Check if we have documents and vector store
-            if not os.path.exists("data/pdfs") or not os.listdir("data/pdfs"):
-                st.info("No contract documents found. Creating CUAD contract documents...")
-                processor.download_cuad_contracts()
-            
-            # Load or create vector store
-            processor.load_vector_store()
-            
-            # Initialize compliance checker
-            checker = ComplianceChecker()
-            
-            st.success("System initialized successfully!")
-            return checker
-            
+        # Build a missing store before keying the cache on its version; keying on None would be
+        # missed on the next rerun, once the build has given the store a version
+        index_version = current_store_version()
+        if index_version is None:
+            with st.spinner("Building the vector store..."):
+                open_store()
+            index_version = current_store_version()
+        return load_system(index_version)
     except Exception as e:
         st.error(f"Failed to initialize system: {e}")
         return None
 
+def show_performance_breakdown():
+    """Sidebar table of time per pipeline stage from this session or the last exported run report"""
+    report = METRICS.snapshot()
+    if not report['spans']:
+        report = load_report()
+    if not report.get('spans'):
+        return
+    
+    with st.expander("Performance Breakdown"):
+        st.dataframe([{
+            'Stage': name,
+            'Calls': stats['count'],
+            'Total (s)': round(stats['total_seconds'], 3),
+            'Mean (ms)': round(stats['mean_seconds'] * 1000, 1),
+            'Max (ms)': round(stats['max_seconds'] * 1000, 1)
+        } for name, stats in report['spans'].items()], hide_index=True)
+        if report.get('counters'):
+            st.write("**Counters:** " + ", ".join(f"{name}={value:g}" for name, value in report['counters'].items()))
+
+def show_run_progress():
+    """Show results logged so far by an unfinished (running or interrupted) compliance run"""
+    run_log = RunLog()
+    run = run_log.latest_run()
+    if run is None or run['complete']:
+        return
+    
+    logged = run_log.results(run['run_id'])
+    label = "Compliance matrix" if run['kind'] == 'matrix' else "Compliance check"
+    st.subheader(f"⏳ {label} in progress")
+    st.caption(f"Run {run['run_id'][:8]} started {run['started']}. "
+               "An interrupted run resumes from here when it is started again, unless the index or rules have changed.")
+    st.progress(min(len(logged) / max(run['total'], 1), 1.0), text=f"{len(logged)}/{run['total']} results logged")
+    
+    for (filename, rule_id), rule_result in logged.items():
+        source = f"{filename}: " if filename else ""
+        st.write(f"• {source}{rule_result['rule_title']} - {rule_result['compliance_status']}")
+    
+    if st.button("Refresh progress"):
+        st.rerun()
+    st.markdown("---")
+
 def main():
     st.title("📋 Legal Contract Compliance Checker")
     st.markdown("""
@@ -59,14 +117,16 @@ def main():
         st.write(f"**Total Compliance Rules:** {len(rules)}")
         
         # Show document info
-        if os.path.exists("data/pdfs"):
-            pdf_files = [f for f in os.listdir("data/pdfs") if f.endswith(('.txt', '.pdf'))]
+        if os.path.exists(PDF_DIR):
+            pdf_files = [f for f in os.listdir(PDF_DIR) if f.endswith(('.txt', '.pdf'))]
             st.write(f"**Contract Documents:** {len(pdf_files)}")
             
             with st.expander("Document List"):
                 for file in pdf_files:
                     st.write(f"• {file}")
         
+        show_performance_breakdown()
+        
         st.markdown("---")
         st.markdown("**Powered by Gemini AI**")
     
@@ -96,10 +156,11 @@ def main():
     with tab2:
         st.header("📊 Compliance Results")
         
+        show_run_progress()
+        
         if os.path.exists(RESULTS_FILE):
             try:
-                with open(RESULTS_FILE, 'r') as f:
-                    results = json.load(f)
+                results = load_results(RESULTS_FILE, os.path.getmtime(RESULTS_FILE))
                 
                 # Summary metrics
                 col1, col2, col3, col4 = st.columns(4)
@@ -183,9 +244,7 @@ def main():
         if search_query:
             with st.spinner("Searching documents..."):
                 try:
-                    processor = PDFProcessor()
-                    processor.load_vector_store()
-                    results = processor.search_documents(search_query, k=5)
+                    results = checker.pdf_processor.search_documents(search_query, k=5)
                     
                     if results:
                         st.write(f"Found {len(results)} relevant sections:")
@@ -193,7 +252,12 @@ def main():
                         for i, result in enumerate(results, 1):
                             with st.expander(f"Result {i}: {result['metadata']['filename']} (Score: {result['similarity']:.3f})"):
                                 st.write(result['content'])
-                                st.caption(f"Source: {result['metadata']['filename']}, Chunk {result['metadata']['chunk_id']+1}/{result['metadata']['total_chunks']}")
+                                caption = f"Source: {result['metadata']['filename']}, Chunk {result['metadata']['chunk_id']+1}/{result['metadata']['total_chunks']}"
+                                if 'page_start' in result['metadata']:
+                                    caption += f", Pages {result['metadata']['page_start']}-{result['metadata']['page_end']}"
+                                if result['metadata'].get('duplicates'):
+                                    caption += f", also in {len(result['metadata']['duplicates'])} more chunk(s)"
+                                st.caption(caption)
                     else:
                         st.info("No relevant documents found for your query.")
                         
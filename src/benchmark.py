@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Tuple
+from config import RETRIEVAL_ENGINE, INGEST_WORKERS, OFFLINE_LATENCY
+from retrieval import RETRIEVAL_ENGINES
+
+# End-to-end benchmark over synthetic CUAD-style corpora. Each corpus size runs in its own
+# process with COMPLIANCE_DATA_DIR pointing at a scratch directory, so data paths, caches and
+# peak RSS are isolated per size. Results are written as JSON for comparison across commits.
+
+# Cold-start budgets: milliseconds to import each entry point in a fresh interpreter, plus the
+# heavy packages that must only be imported on first use, never by importing an entry point
+IMPORT_BUDGETS_MS = {
+    'config': 50,
+    'run_log': 150,
+    'pdf_processor': 500,
+    'compliance_checker': 600,
+    'benchmark': 500,
+}
+LAZY_IMPORTS = ('sklearn', 'scipy', 'streamlit', 'google.generativeai', 'pypdf')
+
+CONTRACT_TYPES = [
+    "SOFTWARE LICENSE AGREEMENT", "PROFESSIONAL SERVICES AGREEMENT", "MASTER SERVICES AGREEMENT",
+    "VENDOR SUPPLY AGREEMENT", "DISTRIBUTION AGREEMENT", "CONSULTING AGREEMENT",
+    "DATA PROCESSING AGREEMENT", "RESELLER AGREEMENT", "MAINTENANCE AND SUPPORT AGREEMENT",
+    "JOINT DEVELOPMENT AGREEMENT"
+]
+
+PARTIES = [
+    "TechCorp Solutions, Inc.", "Northwind Analytics LLC", "Bluefin Systems Ltd.", "Apex Logistics Corp.",
+    "Meridian Health Partners", "Quantum Retail Group", "Silverline Consulting LLP", "Harbor Data Services Inc."
+]
+
+STATES = ["Delaware", "New York", "California", "Texas", "Illinois", "Massachusetts", "Washington"]
+
+# Clause headings and sentence templates by topic, one topic per compliance rule
+CLAUSES = {
+    "liability": (["LIMITATION OF LIABILITY", "LIMITATION OF LIABILITY AND INDEMNIFICATION"], [
+        "{provider}'s total liability is limited to fees paid in the {months} months preceding the claim.",
+        "Neither party shall be liable for indirect, incidental, special or consequential damages.",
+        "Each party shall indemnify the other against third-party claims arising from its negligence.",
+        "The liability cap shall not apply to breaches of confidentiality or willful misconduct.",
+        "Aggregate damages under this Agreement shall not exceed ${amount}.",
+    ]),
+    "termination": (["TERM AND TERMINATION", "TERMINATION"], [
+        "The initial term is {years} years and renews automatically unless either party gives notice.",
+        "Either party may terminate for material breach not cured within {days} days of written notice.",
+        "Immediate termination is permitted upon insolvency or bankruptcy of the other party.",
+        "Upon termination, {client} shall pay all fees accrued through the termination date.",
+        "Either party may terminate for convenience upon {days} days prior written notice.",
+    ]),
+    "confidentiality": (["CONFIDENTIALITY", "CONFIDENTIALITY AND NON-DISCLOSURE"], [
+        "Each party shall protect the other's Confidential Information with reasonable care.",
+        "Confidential Information excludes information that is publicly available without breach.",
+        "Confidentiality obligations continue for {years} years after termination of this Agreement.",
+        "Trade secrets shall remain confidential for as long as they qualify as trade secrets.",
+        "Disclosure is permitted where required by law, subject to prompt notice to the disclosing party.",
+    ]),
+    "intellectual_property": (["INTELLECTUAL PROPERTY RIGHTS", "OWNERSHIP AND LICENSE"], [
+        "{provider} retains all right, title and interest in its pre-existing intellectual property.",
+        "Deliverables created for {client} are works made for hire and owned by {client}.",
+        "{provider} grants {client} a non-exclusive, non-transferable license to use the Software.",
+        "No patent, copyright or trademark rights are granted except as expressly stated herein.",
+        "{client} shall not reverse engineer, decompile or create derivative works.",
+    ]),
+    "payment": (["FEES AND PAYMENT TERMS", "PAYMENT"], [
+        "{client} shall pay all invoices within {days} days of receipt.",
+        "Late payments accrue interest at {percent} percent per month.",
+        "Fees are exclusive of taxes, which are the responsibility of {client}.",
+        "{provider} may suspend services if any invoice remains unpaid for {days} days.",
+        "Annual fees of ${amount} are billed in advance on each anniversary of the Effective Date.",
+    ]),
+    "data_protection": (["DATA PROTECTION AND PRIVACY", "PERSONAL DATA"], [
+        "Personal data shall be processed in accordance with GDPR, CCPA and applicable privacy laws.",
+        "All personal data must be encrypted at rest and in transit using AES-256 encryption.",
+        "Data subjects retain rights to access, rectification and erasure of personal data.",
+        "Cross-border transfers require standard contractual clauses or equivalent safeguards.",
+        "Personal data shall be deleted within {days} days after termination.",
+    ]),
+    "service_levels": (["SERVICE LEVELS", "SERVICE LEVEL AGREEMENT"], [
+        "{provider} guarantees {uptime} percent monthly availability of the services.",
+        "Critical incidents receive a response within {hours} hours, twenty-four hours a day.",
+        "Service credits of {percent} percent of monthly fees apply for each missed service level.",
+        "Performance reports are delivered to {client} on a monthly basis.",
+        "Scheduled maintenance windows are excluded from availability calculations.",
+    ]),
+    "governing_law": (["GOVERNING LAW AND DISPUTE RESOLUTION", "GOVERNING LAW"], [
+        "This Agreement is governed by the laws of {state}, excluding its conflict of law rules.",
+        "Disputes shall be resolved by binding arbitration under the AAA Commercial Rules.",
+        "The courts of {state} have exclusive jurisdiction over any action arising hereunder.",
+        "Either party may seek equitable relief to protect its intellectual property.",
+        "The prevailing party is entitled to recover reasonable attorneys' fees.",
+    ]),
+    "insurance": (["INSURANCE", "INSURANCE REQUIREMENTS"], [
+        "{provider} shall maintain commercial general liability insurance of at least ${amount}.",
+        "Professional liability and errors and omissions coverage of ${amount} is required.",
+        "Cyber liability insurance shall cover data breaches and network security failures.",
+        "Certificates of insurance shall be provided to {client} upon request.",
+        "{client} shall be named as an additional insured on the general liability policy.",
+    ]),
+    "regulatory": (["COMPLIANCE WITH LAWS", "REGULATORY COMPLIANCE"], [
+        "Each party shall comply with all applicable laws, regulations and industry standards.",
+        "{provider} shall maintain SOC 2 Type II and ISO 27001 certifications.",
+        "Both parties shall comply with anti-corruption laws including the FCPA.",
+        "Export of the Software is subject to applicable export control regulations.",
+        "{provider} shall obtain and maintain all licenses and permits required to perform.",
+    ]),
+    "force_majeure": (["FORCE MAJEURE"], [
+        "Neither party is liable for delays caused by events beyond its reasonable control.",
+        "Force majeure events include natural disasters, pandemics, war and government action.",
+        "The affected party shall notify the other party within {days} days of the event.",
+        "If a force majeure event continues for {days} days, either party may terminate.",
+        "Payment obligations are not excused by a force majeure event.",
+    ]),
+    "assignment": (["ASSIGNMENT", "ASSIGNMENT AND SUBCONTRACTING"], [
+        "Neither party may assign this Agreement without the prior written consent of the other.",
+        "Assignment to a successor in a merger or acquisition is permitted upon notice.",
+        "{provider} may engage subcontractors but remains responsible for their performance.",
+        "Any attempted assignment in violation of this section is void.",
+        "This Agreement binds and benefits the parties and their permitted assigns.",
+    ]),
+    "audit": (["AUDIT RIGHTS", "RECORDS AND AUDIT"], [
+        "{client} may audit {provider}'s records relating to this Agreement once per year.",
+        "Audits require {days} days advance notice and occur during normal business hours.",
+        "{provider} shall retain records for {years} years after termination.",
+        "Compliance reports are provided to {client} on a quarterly basis.",
+        "Audit costs are borne by {client} unless a material discrepancy is found.",
+    ]),
+    "security_incident": (["SECURITY INCIDENTS", "SECURITY AND INCIDENT RESPONSE"], [
+        "{provider} shall notify {client} of any security incident within {hours} hours.",
+        "{provider} shall maintain a documented incident response plan tested annually.",
+        "Multi-factor authentication is required for all administrative access.",
+        "Security incidents shall be investigated and remediated without undue delay.",
+        "{provider} shall cooperate with {client} in any breach notification obligations.",
+    ]),
+    "survival": (["SURVIVAL", "GENERAL PROVISIONS"], [
+        "Provisions on confidentiality, liability and governing law survive termination.",
+        "Payment obligations accrued before termination survive expiration of this Agreement.",
+        "This Agreement constitutes the entire agreement between the parties.",
+        "Amendments must be in writing and signed by both parties.",
+        "If any provision is held invalid, the remaining provisions remain in full force.",
+    ]),
+}
+
+DEFINITIONS = [
+    '"Agreement" means this {title_case} and all exhibits and amendments hereto.',
+    '"Effective Date" means the date on which this Agreement is signed by both parties.',
+    '"Confidential Information" means all non-public information disclosed by either party.',
+    '"Services" means the services described in the applicable Statement of Work.',
+]
+
+def generate_contract(rng: random.Random) -> str:
+    """Assemble one contract from randomly chosen clause topics, headings and sentences"""
+    title = rng.choice(CONTRACT_TYPES)
+    provider, client = rng.sample(PARTIES, 2)
+    values = {
+        'provider': provider, 'client': client, 'state': rng.choice(STATES),
+        'title_case': title.title(), 'days': rng.choice([10, 15, 30, 45, 60, 90]),
+        'months': rng.choice([6, 12, 24]), 'years': rng.choice([1, 2, 3, 5, 7]),
+        'hours': rng.choice([4, 24, 48, 72]), 'percent': rng.choice([1, 1.5, 2, 5, 10]),
+        'uptime': rng.choice([99, 99.5, 99.9, 99.99]), 'amount': f"{rng.choice([1, 2, 5, 10]) * 1000000:,}"
+    }
+
+    lines = [title, "", "1. DEFINITIONS"]
+    lines += [sentence.format(**values) for sentence in DEFINITIONS]
+    topics = rng.sample(sorted(CLAUSES), rng.randint(8, len(CLAUSES)))
+    for number, topic in enumerate(topics, 2):
+        headings, sentences = CLAUSES[topic]
+        lines += ["", f"{number}. {rng.choice(headings)}"]
+        chosen = rng.sample(sentences, rng.randint(3, len(sentences)))
+        lines += [sentence.format(**values) for sentence in chosen]
+    return "\n".join(lines) + "\n"
+
+def generate_corpus(pdf_dir: str, num_contracts: int, seed: int = 0) -> int:
+    """Write num_contracts synthetic contracts as .txt files, returning the total bytes written"""
+    os.makedirs(pdf_dir, exist_ok=True)
+    rng = random.Random(seed)
+    total_bytes = 0
+    for i in range(num_contracts):
+        text = generate_contract(rng)
+        with open(os.path.join(pdf_dir, f"contract_{i:06d}.txt"), 'w') as f:
+            f.write(text)
+        total_bytes += len(text.encode('utf-8'))
+    return total_bytes
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def latency_percentiles(latencies: List[float]) -> Dict:
+    """p50/p95/p99 and mean of a list of latencies in seconds, reported in milliseconds"""
+    import numpy as np
+
+    values = np.array(latencies) * 1000.0
+    return {
+        'count': len(latencies),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+    }
+
+def run_size(size: int, args) -> Dict:
+    """Benchmark one corpus size; runs inside the per-size worker process"""
+    # Imported here so they pick up the COMPLIANCE_DATA_DIR set for this worker
+    from config import PDF_DIR
+    from pdf_processor import PDFProcessor
+    from compliance_checker import ComplianceChecker
+    from llm_backends import OfflineBackend
+
+    result = {'num_contracts': size, 'engine': args.engine, 'phases': {}}
+    phases = result['phases']
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        value = fn()
+        phases[name] = {'seconds': round(time.perf_counter() - start, 4), 'peak_rss_mb': peak_rss_mb()}
+        print(f"  {name}: {phases[name]['seconds']:.3f}s")
+        return value
+
+    result['corpus_bytes'] = timed('generate_corpus', lambda: generate_corpus(PDF_DIR, size, args.seed))
+
+    processor = PDFProcessor(engine=args.engine)
+    stats = timed('process_documents', lambda: processor.process_documents(workers=args.workers))
+    result['num_chunks'] = stats['total_chunks']
+    timed('create_vector_store', processor.create_vector_store)
+
+    processor = PDFProcessor(engine=args.engine)
+    timed('load_vector_store', processor.load_vector_store)
+
+    checker = ComplianceChecker(use_cache=True, backend=OfflineBackend(latency=args.llm_latency, seed=args.seed),
+                                pdf_processor=processor)
+    rng = random.Random(args.seed)
+    rule_queries = [checker.build_search_query(rule_data) for rule_data in checker.rules.values()]
+    queries = [rng.choice(rule_queries) if i % 2 else ' '.join(rng.choice(rule_queries).split()[:3])
+               for i in range(args.queries)]
+
+    latencies = []
+    def search_all():
+        for query in queries:
+            start = time.perf_counter()
+            processor.search_documents(query, k=5)
+            latencies.append(time.perf_counter() - start)
+    timed('search_documents', search_all)
+    phases['search_documents'].update(latency_percentiles(latencies))
+    timed('search_documents_batch', lambda: processor.search_documents_batch(queries, k=5))
+
+    # A cold check calls the model for every rule; the warm rerun is served from the verdict cache
+    checker.cache.clear()
+    for name in ('run_full_compliance_check', 'run_full_compliance_check_cached'):
+        calls = checker.backend.calls
+        timed(name, lambda: checker.run_full_compliance_check(resume=False))
+        phases[name]['llm_calls'] = checker.backend.calls - calls
+
+    from instrumentation import METRICS
+    result['stages'] = METRICS.snapshot()['spans']
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def measure_import(module: str, repeats: int = 3) -> Dict:
+    """Best-of-n time to import a module in a fresh interpreter, and which lazy packages it loaded"""
+    script = (
+        "import sys, time, json\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        f"print(json.dumps({{'ms': elapsed, 'loaded': [m for m in {LAZY_IMPORTS!r} if m in sys.modules]}}))"
+    )
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    elapsed = min(run['ms'] for run in runs)
+    loaded = runs[0]['loaded']
+    return {
+        'module': module,
+        'ms': round(elapsed, 1),
+        'budget_ms': IMPORT_BUDGETS_MS[module],
+        'lazy_loaded': loaded,
+        'ok': elapsed <= IMPORT_BUDGETS_MS[module] and not loaded
+    }
+
+def check_import_budgets() -> Tuple[List[Dict], bool]:
+    """Measure every entry point against its import budget"""
+    results = [measure_import(module) for module in IMPORT_BUDGETS_MS]
+    for result in results:
+        status = "ok" if result['ok'] else "OVER BUDGET"
+        loaded = f" (loaded {', '.join(result['lazy_loaded'])})" if result['lazy_loaded'] else ""
+        print(f"  import {result['module']}: {result['ms']:.1f}ms / {result['budget_ms']}ms {status}{loaded}")
+    return results, all(result['ok'] for result in results)
+
+def git_commit() -> str:
+    """Current commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, indexing, search and checking on synthetic corpora")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help="corpus sizes in contracts")
+    parser.add_argument('--queries', type=int, default=200, help="search queries timed per size")
+    parser.add_argument('--engine', default=RETRIEVAL_ENGINE, choices=RETRIEVAL_ENGINES)
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="ingestion processes (0 = all CPUs)")
+    parser.add_argument('--llm-latency', type=float, default=OFFLINE_LATENCY, help="offline model latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--workdir', help="scratch directory (a temporary one is created and removed by default)")
+    parser.add_argument('--imports', action='store_true',
+                        help="only check import-time budgets, exiting non-zero when one is exceeded")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        with open(args.result, 'w') as f:
+            json.dump(run_size(args.worker, args), f)
+        return
+
+    if args.imports:
+        print("Checking import-time budgets...")
+        _, ok = check_import_budgets()
+        sys.exit(0 if ok else 1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='compliance-bench-')
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('worker', 'result')},
+        'results': []
+    }
+
+    print("Measuring import times...")
+    report['imports'], _ = check_import_budgets()
+
+    try:
+        for size in args.sizes:
+            print(f"Benchmarking {size} contracts...")
+            data_dir = os.path.join(workdir, f"size_{size}")
+            result_file = os.path.join(workdir, f"result_{size}.json")
+            command = [sys.executable, os.path.abspath(__file__), '--worker', str(size), '--result', result_file,
+                       '--queries', str(args.queries), '--engine', args.engine, '--workers', str(args.workers),
+                       '--llm-latency', str(args.llm_latency), '--seed', str(args.seed)]
+            completed = subprocess.run(command, env=dict(os.environ, COMPLIANCE_DATA_DIR=data_dir),
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            if completed.returncode != 0:
+                print(completed.stdout)
+                print(f"Benchmark for {size} contracts failed")
+                report['results'].append({'num_contracts': size, 'error': completed.stdout[-2000:]})
+                continue
+            print('\n'.join(line for line in completed.stdout.splitlines() if line.startswith('  ')))
+            with open(result_file, 'r') as f:
+                report['results'].append(json.load(f))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import mmap
+from collections.abc import Sequence
+from typing import List
+import numpy as np
+from store_format import save_array, load_array, save_json, load_json
+
+# Chunk texts live in one concatenated UTF-8 blob addressed by a byte-offset array. Metadata is
+# split into numeric columns, a filename table and an optional per-chunk JSON blob for any other
+# keys, so a search only decodes the k chunks it returns. Chunks standing for near-duplicates in
+# other files carry their metadata in a 'duplicates' list; a (row, file) table of those
+# back-references lets rows_for_file find them without decoding any metadata.
+NUMERIC_FIELDS = ('chunk_id', 'total_chunks', 'char_count', 'page_start', 'page_end')
+MISSING = -1
+
+def _write_blob(path: str, items: List[bytes]) -> np.ndarray:
+    """Concatenate byte strings into a file atomically, returning their offsets"""
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    with open(path + '.tmp', 'wb') as f:
+        for i, item in enumerate(items):
+            f.write(item)
+            offsets[i + 1] = offsets[i] + len(item)
+    os.replace(path + '.tmp', path)
+    return offsets
+
+def _open_blob(path: str):
+    """Memory-map a blob file read-only (empty files cannot be mapped)"""
+    if os.path.getsize(path) == 0:
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def write_chunk_store(store_dir: str, chunks, metadata):
+    """Write chunk texts and metadata in the offset-indexed layout"""
+    offsets = _write_blob(os.path.join(store_dir, 'chunks.bin'), [chunk.encode('utf-8') for chunk in chunks])
+    save_array(store_dir, 'chunk_offsets', offsets)
+
+    filenames = []
+    file_ids = {}
+    def file_id(filename):
+        if filename not in file_ids:
+            file_ids[filename] = len(filenames)
+            filenames.append(filename)
+        return file_ids[filename]
+    
+    files = np.zeros(len(metadata), dtype=np.int32)
+    numeric = np.full((len(metadata), len(NUMERIC_FIELDS)), MISSING, dtype=np.int64)
+    extras = []
+    reference_rows, reference_files = [], []
+    for row, meta in enumerate(metadata):
+        files[row] = file_id(meta['filename'])
+        for copy in meta.get('duplicates', ()):
+            reference_rows.append(row)
+            reference_files.append(file_id(copy['filename']))
+        for col, field in enumerate(NUMERIC_FIELDS):
+            if field in meta:
+                numeric[row, col] = meta[field]
+        extra = {key: value for key, value in meta.items() if key != 'filename' and key not in NUMERIC_FIELDS}
+        extras.append(json.dumps(extra).encode('utf-8') if extra else b'')
+
+    save_array(store_dir, 'chunk_files', files)
+    save_array(store_dir, 'chunk_reference_rows', np.array(reference_rows, dtype=np.int64))
+    save_array(store_dir, 'chunk_reference_files', np.array(reference_files, dtype=np.int32))
+    save_json(store_dir, 'chunk_filenames.json', filenames)
+    save_array(store_dir, 'chunk_numeric', numeric)
+    extra_offsets = _write_blob(os.path.join(store_dir, 'chunk_extra.bin'), extras)
+    save_array(store_dir, 'chunk_extra_offsets', extra_offsets)
+
+class ChunkTextView(Sequence):
+    """Read-only list of chunk texts decoded lazily from the memory-mapped blob"""
+
+    def __init__(self, store_dir: str):
+        self.blob = _open_blob(os.path.join(store_dir, 'chunks.bin'))
+        self.offsets = load_array(store_dir, 'chunk_offsets')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        return self.blob[int(self.offsets[index]):int(self.offsets[index + 1])].decode('utf-8')
+
+class ChunkMetadataView(Sequence):
+    """Read-only list of chunk metadata dicts built on demand from the numeric columns"""
+
+    def __init__(self, store_dir: str):
+        self.files = load_array(store_dir, 'chunk_files')
+        self.filenames = load_json(store_dir, 'chunk_filenames.json')
+        self.numeric = load_array(store_dir, 'chunk_numeric')
+        self.extra_blob = _open_blob(os.path.join(store_dir, 'chunk_extra.bin'))
+        self.extra_offsets = load_array(store_dir, 'chunk_extra_offsets')
+        try:
+            self.reference_rows = load_array(store_dir, 'chunk_reference_rows')
+            self.reference_files = load_array(store_dir, 'chunk_reference_files')
+        except FileNotFoundError:
+            # Stores written before back-references were indexed
+            self.reference_rows = np.array([], dtype=np.int64)
+            self.reference_files = np.array([], dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+
+        meta = {'filename': self.filenames[self.files[index]]}
+        for col, field in enumerate(NUMERIC_FIELDS):
+            value = int(self.numeric[index, col])
+            if value != MISSING:
+                meta[field] = value
+        start, end = int(self.extra_offsets[index]), int(self.extra_offsets[index + 1])
+        if end > start:
+            meta.update(json.loads(self.extra_blob[start:end].decode('utf-8')))
+        return meta
+
+    def rows_for_file(self, filename: str) -> np.ndarray:
+        """Row indices of all chunks of one file, including rows standing for its duplicates,
+        without decoding any metadata"""
+        if filename not in self.filenames:
+            return np.array([], dtype=np.int64)
+        file_id = self.filenames.index(filename)
+        rows = np.flatnonzero(self.files == file_id)
+        if len(self.reference_rows):
+            rows = np.union1d(rows, self.reference_rows[self.reference_files == file_id])
+        return rows
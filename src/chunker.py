@@ -0,0 +1,136 @@
+import re
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from config import CHUNK_SIZE, CHUNK_OVERLAP, CLAUSE_ALIGNED_CHUNKS
+
+# Word-window chunking over character offsets. Each page is tokenized once into the start and
+# end offsets of its words; a chunk is then a single slice of the original text from its first
+# word's start to its last word's end, instead of a list of word strings joined back together.
+# With clause alignment, consecutive clauses are still packed into full windows, but a window
+# whose second half contains a numbered clause heading such as "5. LIMITATION OF LIABILITY"
+# is cut just before the last such heading, so clauses start chunks instead of being split.
+
+WORD = re.compile(r'\S+')
+
+# A line holding only a clause number and an upper-case title, e.g. "12.1 GOVERNING LAW"
+CLAUSE_HEADING = re.compile(r"^[ \t]*(\d{1,3}(?:\.\d{1,3})*)\.?[ \t]+([A-Z][A-Z0-9&,;:/'()\- ]*[A-Z)])[ \t]*$",
+                            re.MULTILINE)
+
+class Chunk(NamedTuple):
+    text: str
+    page_start: int
+    page_end: int
+    clause_number: Optional[str] = None
+    clause_title: Optional[str] = None
+
+def find_clause_headings(text: str) -> List[Tuple[int, str, str]]:
+    """Character offset, number and title of every clause heading line in text"""
+    return [(match.start(), match.group(1), match.group(2).strip()) for match in CLAUSE_HEADING.finditer(text)]
+
+class TextChunker:
+    """Splits a stream of (page number, text) pairs into overlapping word windows.
+
+    Only the words not yet emitted (at most about one window plus the current page) are kept,
+    and the text buffer is compacted once more than half of it has been consumed.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                 align_clauses: bool = CLAUSE_ALIGNED_CHUNKS):
+        if not 0 <= overlap < chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.step = chunk_size - overlap
+        self.align_clauses = align_clauses
+
+    def chunk_text(self, text: str) -> Iterator[Chunk]:
+        """Chunk a single text (reported as page 1)"""
+        return self.chunk_pages([(1, text)])
+
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Chunk]:
+        """Chunk a stream of pages, yielding chunks as soon as their words are available"""
+        self._buffer = ''
+        self._starts, self._ends, self._pages = [], [], []
+        self._headings = []  # (word index, number, title), in text order
+        self._head = 0       # index of the first word not yet consumed
+        self._clause = (None, None)
+
+        for page_number, text in pages:
+            self._append(page_number, text)
+            yield from self._drain(final=False)
+        yield from self._drain(final=True)
+
+    def _append(self, page_number: int, text: str):
+        self._compact()
+        separator = '\n' if self._buffer else ''
+        base = len(self._buffer) + len(separator)
+        self._buffer += separator + text
+
+        first_word = len(self._starts)
+        for match in WORD.finditer(text):
+            self._starts.append(base + match.start())
+            self._ends.append(base + match.end())
+        self._pages.extend([page_number] * (len(self._starts) - first_word))
+
+        if self.align_clauses:
+            for offset, number, title in find_clause_headings(text):
+                word = bisect_left(self._starts, base + offset, lo=first_word)
+                if word < len(self._starts):
+                    self._headings.append((word, number, title))
+
+    def _compact(self):
+        """Drop consumed words and text once they make up more than half of the buffer"""
+        head = self._head
+        if head == 0 or head * 2 < len(self._starts):
+            return
+        cut = self._starts[head] if head < len(self._starts) else len(self._buffer)
+        self._buffer = self._buffer[cut:]
+        self._starts = [start - cut for start in self._starts[head:]]
+        self._ends = [end - cut for end in self._ends[head:]]
+        self._pages = self._pages[head:]
+        self._headings = [(word - head, number, title) for word, number, title in self._headings]
+        self._head = 0
+
+    def _chunk(self, count: int) -> Chunk:
+        first, last = self._head, self._head + count - 1
+        return Chunk(self._buffer[self._starts[first]:self._ends[last]], self._pages[first], self._pages[last],
+                     *self._clause)
+
+    def _consume(self, count: int):
+        self._head = min(self._head + count, len(self._starts))
+
+    def _drain(self, final: bool) -> Iterator[Chunk]:
+        while True:
+            available = len(self._starts) - self._head
+            if available <= 0:
+                return
+
+            if available < self.chunk_size and not final:
+                return
+
+            if not self.align_clauses:
+                # Same windows as the original word-list chunker, tail windows included
+                yield self._chunk(min(available, self.chunk_size))
+                self._consume(self.step)
+                continue
+
+            # Chunks report the clause their first word belongs to
+            while self._headings and self._headings[0][0] <= self._head:
+                _, number, title = self._headings.pop(0)
+                self._clause = (number, title)
+
+            if available < self.chunk_size:
+                yield self._chunk(available)
+                self._consume(available)
+                continue
+
+            # Cut a full window before the last heading in its second half, without overlap, so
+            # the next chunk starts at that clause; otherwise slide on as usual
+            half = self._head + self.chunk_size // 2
+            cuts = [word for word, _, _ in self._headings if half < word <= self._head + self.chunk_size]
+            if cuts:
+                count = cuts[-1] - self._head
+                yield self._chunk(count)
+                self._consume(count)
+            else:
+                yield self._chunk(self.chunk_size)
+                self._consume(self.step)
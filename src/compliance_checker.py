@@ -1,46 +1,87 @@
 import json
 import os
-from typing import List, Dict, Any
-import google.generativeai as genai
+import hashlib
+from typing import List, Dict, Any, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from pdf_processor import PDFProcessor
+from sharded_store import create_processor
 from compliance_rules import get_all_rules, get_rule
-from config import GEMINI_API_KEY, MODEL_NAME, RESULTS_FILE
+from rate_limiter import RateLimiter, call_with_backoff, estimate_tokens
+from verdict_cache import VerdictCache, make_cache_key
+from run_log import RunLog
+from context_builder import assemble_context
+from instrumentation import span, timed, increment
+from llm_backends import LLMBackend, OfflineBackend, create_backend
+from config import (RESULTS_FILE, MATRIX_RESULTS_FILE, LLM_CONCURRENCY,
+                    LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, VERDICT_CACHE_ENABLED,
+                    LLM_BATCH_RULES, LLM_BATCH_TOKEN_BUDGET, CONTEXT_CANDIDATES, KEYWORD_PRESCAN,
+                    KEYWORD_PRESCAN_CONFIDENCE, KEYWORD_PRESCAN_MAX_SIMILARITY, KEYWORD_MAX_ANCHORS)
+
+# Bump whenever the prompt wording or response format changes so cached verdicts are not reused
+PROMPT_TEMPLATE_VERSION = "1"
+BATCH_PROMPT_TEMPLATE_VERSION = "batch-1"
+
+BATCH_PROMPT_OVERHEAD = """
+Respond with a JSON array containing exactly one object per rule, in this exact format:
+[
+    {
+        "rule_id": "rule id from above",
+        "compliance_status": "COMPLIANT/PARTIAL/NON_COMPLIANT/NOT_ADDRESSED",
+        "confidence": 0.0,
+        "evidence": ["quote1", "quote2"],
+        "suggestions": ["suggestion1", "suggestion2"]
+    }
+]
+"""
+
+def chunk_key(doc: Dict):
+    """Identity of a retrieved passage across rules"""
+    meta = doc['metadata']
+    return (meta['filename'], tuple(meta.get('chunk_ids', [meta['chunk_id']])))
 
 class ComplianceChecker:
-    def __init__(self):
-        # Configure Gemini API
-        genai.configure(api_key=GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(MODEL_NAME)
+    def __init__(self, use_cache: bool = VERDICT_CACHE_ENABLED, backend: Optional[LLMBackend] = None,
+                 pdf_processor: Optional[PDFProcessor] = None):
+        # Model backend (Gemini unless LLM_BACKEND or the caller selects another)
+        self.backend = backend or create_backend()
+        self.rate_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
         
-        # Initialize PDF processor
-        self.pdf_processor = PDFProcessor()
-        self.pdf_processor.load_vector_store()
+        # Cache of verdicts keyed by model, prompt version, rule and evidence
+        self.cache = VerdictCache(enabled=use_cache)
+        
+        # Share the caller's PDF processor when given, so the index is loaded only once; a
+        # ShardedVectorStore (NUM_SHARDS > 1) offers the same search interface
+        self.pdf_processor = pdf_processor or create_processor()
+        self.pdf_processor.ensure_index()
         
         # Load compliance rules
         self.rules = get_all_rules()
         
-    def check_rule_compliance(self, rule_id: str, rule_data: Dict) -> Dict[str, Any]:
-        """Check compliance for a specific rule"""
-        # Search for relevant documents
-        search_query = f"{rule_data['title']} {' '.join(rule_data['keywords'])}"
-        relevant_docs = self.pdf_processor.search_documents(search_query, k=3)
-        
-        if not relevant_docs:
-            return {
-                'rule_id': rule_id,
-                'rule_title': rule_data['title'],
-                'compliance_status': 'NOT_FOUND',
-                'confidence': 0.0,
-                'evidence': [],
-                'suggestions': ['No relevant policy documents found for this rule'],
-                'retrieved_content': []
-            }
+    def generate(self, prompt: str) -> str:
+        """Send a prompt to the model within the rate limits, backing off on quota errors"""
+        def request():
+            tokens = estimate_tokens(prompt)
+            with span('llm.wait'):
+                self.rate_limiter.acquire(tokens)
+            increment('llm.calls')
+            increment('llm.prompt_tokens', tokens)
+            with span('llm.generate'):
+                return self.backend.generate(prompt)
         
+        return call_with_backoff(request)
+    
+    def build_search_query(self, rule_data: Dict) -> str:
+        """Build the retrieval query for a rule"""
+        return f"{rule_data['title']} {' '.join(rule_data['keywords'])}"
+    
+    @timed('check.prompt')
+    def build_prompt(self, rule_data: Dict, relevant_docs: List[Dict]) -> str:
+        """Build the single-rule compliance prompt"""
         # Prepare context for Gemini
         context = "\n\n".join([doc['content'] for doc in relevant_docs])
         
         # Create compliance checking prompt
-        prompt = f"""
+        return f"""
 You are a compliance expert analyzing company policy documents. 
 
 Rule to Check:
@@ -65,87 +106,464 @@ Respond in this exact JSON format:
     "suggestions": ["suggestion1", "suggestion2"]
 }}
 """
+    
+    def not_found_result(self, rule_id: str, rule_data: Dict) -> Dict[str, Any]:
+        """Result for a rule with no retrieved evidence"""
+        return {
+            'rule_id': rule_id,
+            'rule_title': rule_data['title'],
+            'compliance_status': 'NOT_FOUND',
+            'confidence': 0.0,
+            'evidence': [],
+            'suggestions': ['No relevant policy documents found for this rule'],
+            'retrieved_content': []
+        }
+    
+    def not_addressed_result(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict] = ()) -> Dict[str, Any]:
+        """Result for a rule with no keyword hits and no well-matching chunk, decided without the model"""
+        increment('check.prescan_resolved')
+        return {
+            'rule_id': rule_id,
+            'rule_title': rule_data['title'],
+            'compliance_status': 'NOT_ADDRESSED',
+            'confidence': KEYWORD_PRESCAN_CONFIDENCE,
+            'evidence': [],
+            'suggestions': [f"No passage matching this rule or its keywords ({', '.join(rule_data['keywords'])}) "
+                            f"was found in the documents; add a provision covering {rule_data['title'].lower()}"],
+            'retrieved_content': self.format_retrieved_content(relevant_docs),
+            'evidence_anchors': [],
+            'resolved_by': 'keyword_prescan'
+        }
+    
+    def prescan_resolves(self, rule_id: str, relevant_docs: List[Dict], rows=None) -> bool:
+        """Whether a rule can be reported NOT_ADDRESSED without the model: none of its keywords occur
+        (in the given rows, if any) and no retrieved chunk scores KEYWORD_PRESCAN_MAX_SIMILARITY or more"""
+        if self.has_keyword_evidence(rule_id, rows):
+            return False
+        top = max((doc['similarity'] for doc in relevant_docs), default=0.0)
+        return KEYWORD_PRESCAN_MAX_SIMILARITY is None or top < KEYWORD_PRESCAN_MAX_SIMILARITY
+    
+    def has_keyword_evidence(self, rule_id: str, rows=None) -> bool:
+        """Whether any keyword of the rule occurs in the indexed chunks (only the given rows, if any)"""
+        keyword_index = self.pdf_processor.keyword_index
+        if not KEYWORD_PRESCAN or keyword_index is None:
+            return True
+        return keyword_index.has_hits(rule_id, rows)
+    
+    def evidence_anchors(self, rule_id: str, relevant_docs: List[Dict]) -> List[Dict]:
+        """Exact positions of the rule's keywords in the retrieved chunks"""
+        keyword_index = self.pdf_processor.keyword_index
+        if keyword_index is None:
+            return []
+        
+        anchors = []
+        for doc in relevant_docs:
+            meta = doc['metadata']
+            for row, chunk_id in zip(doc.get('rows', []), meta.get('chunk_ids', [meta['chunk_id']])):
+                hits = keyword_index.row_hits(rule_id, row)
+                text = self.pdf_processor.document_chunks[row] if hits else ''
+                for start, end, keyword in hits:
+                    anchors.append({
+                        'filename': meta['filename'],
+                        'chunk_id': chunk_id,
+                        'keyword': keyword,
+                        'start': start,
+                        'end': end,
+                        'snippet': text[max(0, start - 80):end + 80]
+                    })
+                    if len(anchors) >= KEYWORD_MAX_ANCHORS:
+                        return anchors
+        return anchors
+    
+    def error_result(self, rule_id: str, rule_data: Dict, error: Exception) -> Dict[str, Any]:
+        """Result for a rule whose analysis failed"""
+        print(f"Error analyzing rule {rule_id}: {error}")
+        increment('check.errors')
+        return {
+            'rule_id': rule_id,
+            'rule_title': rule_data['title'],
+            'compliance_status': 'ERROR',
+            'confidence': 0.0,
+            'evidence': [],
+            'suggestions': [f'Error occurred during analysis: {str(error)}'],
+            'retrieved_content': []
+        }
+    
+    def finalize_result(self, rule_id: str, rule_data: Dict, analysis: Dict, relevant_docs: List[Dict]) -> Dict[str, Any]:
+        """Attach rule and source metadata to a parsed verdict"""
+        analysis.update({
+            'rule_id': rule_id,
+            'rule_title': rule_data['title'],
+            'retrieved_content': self.format_retrieved_content(relevant_docs),
+            'evidence_anchors': self.evidence_anchors(rule_id, relevant_docs)
+        })
+        return analysis
+    
+    def cache_key(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict],
+                  template_version: str = PROMPT_TEMPLATE_VERSION) -> str:
+        """Identical rule, evidence, model and prompt give an identical verdict"""
+        return make_cache_key(self.backend.model_name, template_version, rule_id, rule_data,
+                              [doc['content'] for doc in relevant_docs])
+    
+    def evidence_fingerprint(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict]) -> str:
+        """Fingerprint of everything a verdict depends on: model, prompt, rule and retrieved chunks.
+        
+        Verdicts may come from the single-rule or the batched prompt, so both template versions count.
+        """
+        payload = json.dumps({
+            'model': self.backend.model_name,
+            'templates': [PROMPT_TEMPLATE_VERSION, BATCH_PROMPT_TEMPLATE_VERSION],
+            'rule_id': rule_id,
+            'rule': rule_data,
+            'chunks': [[doc['metadata']['filename'], doc['metadata']['chunk_id'],
+                        hashlib.sha256(doc['content'].encode('utf-8')).hexdigest()] for doc in relevant_docs]
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def cached_verdict(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict]) -> Optional[Dict]:
+        """Look up a verdict produced by either the single-rule or the batched prompt"""
+        return self.cache.get_any([self.cache_key(rule_id, rule_data, relevant_docs, template_version)
+                                   for template_version in (PROMPT_TEMPLATE_VERSION, BATCH_PROMPT_TEMPLATE_VERSION)])
+    
+    def run_context(self) -> Dict[str, str]:
+        """What a run's results depend on besides the run itself; an interrupted run resumes only if it is unchanged"""
+        self.pdf_processor.ensure_index()
+        rules = json.dumps(self.rules, sort_keys=True)
+        return {
+            'store_version': self.pdf_processor.index_version,
+            'rules': hashlib.sha256(rules.encode('utf-8')).hexdigest()[:16],
+            'model': self.backend.model_name
+        }
+    
+    def retrieve(self, queries: List[str], filename: Optional[str] = None) -> List[List[Dict]]:
+        """Retrieve candidate chunks per query and assemble them into budgeted, deduplicated context"""
+        with span('check.retrieve'):
+            candidates = self.pdf_processor.search_documents_batch(queries, k=CONTEXT_CANDIDATES, filename=filename)
+        with span('check.context'):
+            passages = [assemble_context(docs) for docs in candidates]
+        
+        # Remember which index rows each passage covers, to look up keyword hits in them
+        for docs, query_passages in zip(candidates, passages):
+            rows = {(doc['metadata']['filename'], doc['metadata']['chunk_id']): doc['row'] for doc in docs}
+            for passage in query_passages:
+                meta = passage['metadata']
+                passage['rows'] = [rows[(meta['filename'], chunk_id)] for chunk_id in meta['chunk_ids']]
+        return passages
+    
+    def check_rule_compliance(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict] = None,
+                              rows=None) -> Dict[str, Any]:
+        """Check compliance for a specific rule (retrieved from the given index rows, if any)"""
+        # Search for relevant documents unless retrieval was already done in a batch
+        if relevant_docs is None:
+            relevant_docs = self.retrieve([self.build_search_query(rule_data)])[0]
+        
+        if self.prescan_resolves(rule_id, relevant_docs, rows):
+            return self.not_addressed_result(rule_id, rule_data, relevant_docs)
+        
+        if not relevant_docs:
+            return self.not_found_result(rule_id, rule_data)
+        
+        try:
+            analysis = self.cached_verdict(rule_id, rule_data, relevant_docs)
+        except Exception as e:
+            return self.error_result(rule_id, rule_data, e)
         
+        if analysis is not None:
+            return self.finalize_result(rule_id, rule_data, analysis, relevant_docs)
+        
+        return self.analyze_rule(rule_id, rule_data, relevant_docs)
+    
+    def analyze_rule(self, rule_id: str, rule_data: Dict, relevant_docs: List[Dict]) -> Dict[str, Any]:
+        """Ask the model for a single-rule verdict and cache it"""
         try:
             # Get response from Gemini
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
-            # Try to extract JSON from response
-            if '```json' in response_text:
-                json_start = response_text.find('```json') + 7
-                json_end = response_text.find('```', json_start)
-                json_text = response_text[json_start:json_end]
-            elif '{' in response_text and '}' in response_text:
-                json_start = response_text.find('{')
-                json_end = response_text.rfind('}') + 1
-                json_text = response_text[json_start:json_end]
-            else:
-                json_text = response_text
+            prompt = self.build_prompt(rule_data, relevant_docs)
+            response_text = self.generate(prompt).strip()
             
             # Parse the JSON response
-            analysis = json.loads(json_text)
+            analysis = self.parse_json_response(response_text)
+            self.cache.put(self.cache_key(rule_id, rule_data, relevant_docs), analysis)
             
-            # Add additional metadata
-            analysis.update({
-                'rule_id': rule_id,
-                'rule_title': rule_data['title'],
-                'retrieved_content': [{
-                    'content': doc['content'][:200] + '...' if len(doc['content']) > 200 else doc['content'],
-                    'source': doc['metadata']['filename'],
-                    'similarity': doc['similarity']
-                } for doc in relevant_docs]
-            })
+            return self.finalize_result(rule_id, rule_data, analysis, relevant_docs)
             
-            return analysis
+        except Exception as e:
+            return self.error_result(rule_id, rule_data, e)
+    
+    def group_rules(self, work: List, token_budget: int = LLM_BATCH_TOKEN_BUDGET) -> List[List]:
+        """Group (rule_id, rule_data, relevant_docs) items that share retrieved chunks.
+        
+        A rule joins the group it shares the most chunks with, as long as the group's
+        estimated prompt (unique chunks plus rule descriptions) stays within token_budget.
+        """
+        groups = []
+        for item in work:
+            rule_id, rule_data, relevant_docs = item
+            keys = {chunk_key(doc) for doc in relevant_docs}
+            rule_tokens = estimate_tokens(json.dumps(rule_data))
+            
+            best, best_overlap = None, 0
+            for group in groups:
+                overlap = len(keys & group['chunks'])
+                if overlap <= best_overlap:
+                    continue
+                new_tokens = sum(estimate_tokens(doc['content']) for doc in relevant_docs
+                                 if chunk_key(doc) not in group['chunks'])
+                if group['tokens'] + new_tokens + rule_tokens <= token_budget:
+                    best, best_overlap = group, overlap
             
+            if best is None:
+                best = {'items': [], 'chunks': set(), 'tokens': estimate_tokens(BATCH_PROMPT_OVERHEAD)}
+                groups.append(best)
+            
+            best['tokens'] += rule_tokens + sum(estimate_tokens(doc['content']) for doc in relevant_docs
+                                                if chunk_key(doc) not in best['chunks'])
+            best['chunks'] |= keys
+            best['items'].append(item)
+        
+        return [group['items'] for group in groups]
+    
+    @timed('check.prompt')
+    def build_batch_prompt(self, items: List) -> str:
+        """Build one prompt evaluating several rules against their shared context"""
+        # Each distinct chunk is sent once and referenced by number
+        chunk_numbers = {}
+        context_parts = []
+        for _, _, relevant_docs in items:
+            for doc in relevant_docs:
+                key = chunk_key(doc)
+                if key not in chunk_numbers:
+                    chunk_numbers[key] = len(chunk_numbers) + 1
+                    context_parts.append(f"[Chunk {chunk_numbers[key]}]\n{doc['content']}")
+        
+        rule_parts = []
+        for rule_id, rule_data, relevant_docs in items:
+            chunks = ', '.join(str(chunk_numbers[chunk_key(doc)]) for doc in relevant_docs)
+            rule_parts.append(f"""Rule ID: {rule_id}
+Title: {rule_data['title']}
+Description: {rule_data['description']}
+Keywords: {', '.join(rule_data['keywords'])}
+Relevant chunks: {chunks}""")
+        
+        rules_text = "\n\n".join(rule_parts)
+        context = "\n\n".join(context_parts)
+        return f"""
+You are a compliance expert analyzing company policy documents. 
+
+Rules to Check:
+{rules_text}
+
+Policy Documents Context:
+{context}
+
+For each rule, analyze whether the policy documents comply with it, using only its relevant chunks. Provide:
+1. Compliance status (COMPLIANT, PARTIAL, NON_COMPLIANT, or NOT_ADDRESSED)
+2. Confidence score (0.0 to 1.0)
+3. Specific evidence from the documents (quote relevant sections)
+4. Suggestions for improvement if non-compliant
+{BATCH_PROMPT_OVERHEAD}"""
+    
+    def check_rule_group(self, items: List) -> Dict[str, Dict]:
+        """Check uncached rules with one model call, splitting the verdict array per rule"""
+        if len(items) == 1:
+            rule_id, rule_data, relevant_docs = items[0]
+            return {rule_id: self.analyze_rule(rule_id, rule_data, relevant_docs)}
+        
+        try:
+            response_text = self.generate(self.build_batch_prompt(items)).strip()
+            verdicts = self.parse_json_array_response(response_text)
         except Exception as e:
-            print(f"Error analyzing rule {rule_id}: {e}")
-            return {
-                'rule_id': rule_id,
-                'rule_title': rule_data['title'],
-                'compliance_status': 'ERROR',
-                'confidence': 0.0,
-                'evidence': [],
-                'suggestions': [f'Error occurred during analysis: {str(e)}'],
-                'retrieved_content': []
-            }
-    
-    def run_full_compliance_check(self) -> Dict[str, Any]:
-        """Run compliance check for all rules"""
-        results = {
-            'timestamp': None,
-            'total_rules': len(self.rules),
-            'rule_results': {},
-            'summary': {
-                'compliant': 0,
-                'partial': 0,
-                'non_compliant': 0,
-                'not_addressed': 0,
-                'errors': 0
-            }
-        }
+            return {rule_id: self.error_result(rule_id, rule_data, e) for rule_id, rule_data, _ in items}
         
-        print(f"Starting compliance check for {len(self.rules)} rules...")
+        by_rule = {verdict.get('rule_id'): verdict for verdict in verdicts if isinstance(verdict, dict)}
         
-        for rule_id, rule_data in self.rules.items():
-            print(f"Checking rule: {rule_data['title']}")
-            
-            rule_result = self.check_rule_compliance(rule_id, rule_data)
-            results['rule_results'][rule_id] = rule_result
+        results = {}
+        for rule_id, rule_data, relevant_docs in items:
+            analysis = by_rule.get(rule_id)
+            if analysis is None:
+                # The model skipped this rule; evaluate it on its own
+                results[rule_id] = self.analyze_rule(rule_id, rule_data, relevant_docs)
+                continue
             
-            # Update summary
+            analysis = {key: value for key, value in analysis.items() if key != 'rule_id'}
+            self.cache.put(self.cache_key(rule_id, rule_data, relevant_docs, BATCH_PROMPT_TEMPLATE_VERSION), analysis)
+            results[rule_id] = self.finalize_result(rule_id, rule_data, analysis, relevant_docs)
+        
+        return results
+    
+    @timed('llm.parse')
+    def parse_json_response(self, response_text: str):
+        """Extract and parse the JSON payload of a model response"""
+        # Try to extract JSON from response
+        if '```json' in response_text:
+            json_start = response_text.find('```json') + 7
+            json_end = response_text.find('```', json_start)
+            json_text = response_text[json_start:json_end]
+        elif '{' in response_text and '}' in response_text:
+            json_start = response_text.find('{')
+            json_end = response_text.rfind('}') + 1
+            json_text = response_text[json_start:json_end]
+        else:
+            json_text = response_text
+        
+        return json.loads(json_text)
+    
+    @timed('llm.parse')
+    def parse_json_array_response(self, response_text: str) -> List[Dict]:
+        """Extract and parse the JSON array of a batched model response"""
+        if '```json' in response_text:
+            json_start = response_text.find('```json') + 7
+            json_end = response_text.find('```', json_start)
+            json_text = response_text[json_start:json_end]
+        elif '[' in response_text and ']' in response_text:
+            json_start = response_text.find('[')
+            json_end = response_text.rfind(']') + 1
+            json_text = response_text[json_start:json_end]
+        else:
+            json_text = response_text
+        
+        verdicts = json.loads(json_text)
+        if not isinstance(verdicts, list):
+            raise ValueError("Expected a JSON array of rule verdicts")
+        return verdicts
+    
+    def format_retrieved_content(self, relevant_docs: List[Dict]) -> List[Dict]:
+        """Summarize retrieved chunks for the results file"""
+        return [{
+            'content': doc['content'][:200] + '...' if len(doc['content']) > 200 else doc['content'],
+            'source': doc['metadata']['filename'],
+            'similarity': doc['similarity']
+        } for doc in relevant_docs]
+    
+    def count_prescan_resolved(self, rule_results) -> int:
+        """Number of results the keyword pre-scan decided without a model call"""
+        return sum(1 for rule_result in rule_results if rule_result.get('resolved_by') == 'keyword_prescan')
+    
+    def summarize(self, rule_results: Dict[str, Dict]) -> Dict[str, int]:
+        """Count rule results by compliance status"""
+        summary = {
+            'compliant': 0,
+            'partial': 0,
+            'non_compliant': 0,
+            'not_addressed': 0,
+            'errors': 0
+        }
+        
+        for rule_result in rule_results.values():
             status = rule_result['compliance_status'].upper()
             if status == 'COMPLIANT':
-                results['summary']['compliant'] += 1
+                summary['compliant'] += 1
             elif status == 'PARTIAL':
-                results['summary']['partial'] += 1
+                summary['partial'] += 1
             elif status == 'NON_COMPLIANT':
-                results['summary']['non_compliant'] += 1
+                summary['non_compliant'] += 1
             elif status == 'NOT_ADDRESSED':
-                results['summary']['not_addressed'] += 1
+                summary['not_addressed'] += 1
             else:
-                results['summary']['errors'] += 1
+                summary['errors'] += 1
+        
+        return summary
+    
+    @timed('check.run', export=True)
+    def run_full_compliance_check(self, concurrency: Optional[int] = None, batch_rules: Optional[bool] = None,
+                                  incremental: bool = False, resume: bool = True) -> Dict[str, Any]:
+        """Run compliance check for all rules.
+        
+        Each rule result is appended to the run log as soon as it completes. With resume=True an
+        interrupted run is continued, skipping rules it already finished, and the final results are
+        assembled from the log. With incremental=True, retrieval is redone but only rules whose
+        evidence fingerprint differs from the previous results are sent to the model.
+        """
+        concurrency = concurrency or LLM_CONCURRENCY
+        batch_rules = LLM_BATCH_RULES if batch_rules is None else batch_rules
+        results = {
+            'timestamp': None,
+            'run_id': None,
+            'total_rules': len(self.rules),
+            'rule_results': {},
+            'summary': {}
+        }
+        
+        log = RunLog()
+        results['run_id'] = log.start('check', resume=resume, context=self.run_context(), total=len(self.rules))
+        completed = {rule_id for (_, rule_id) in log.completed() if rule_id in self.rules}
+        if completed:
+            print(f"Resuming run {results['run_id']}: {len(completed)}/{len(self.rules)} rules already complete")
+        
+        print(f"Starting compliance check for {len(self.rules) - len(completed)} rules...")
+        
+        # Retrieve evidence for every remaining rule in a single pass over the index
+        rule_ids = [rule_id for rule_id in self.rules if rule_id not in completed]
+        queries = [self.build_search_query(self.rules[rule_id]) for rule_id in rule_ids]
+        retrieved = self.retrieve(queries) if rule_ids else []
+        work = [(rule_id, self.rules[rule_id], relevant_docs) for rule_id, relevant_docs in zip(rule_ids, retrieved)]
+        fingerprints = {rule_id: self.evidence_fingerprint(rule_id, rule_data, relevant_docs)
+                        for rule_id, rule_data, relevant_docs in work}
+        
+        def record(task_results):
+            for rule_id, rule_result in task_results.items():
+                rule_result['evidence_fingerprint'] = fingerprints[rule_id]
+                log.append(rule_id, rule_result)
+        
+        if incremental:
+            # Carry forward verdicts whose rule and evidence are unchanged since the last run
+            previous = self.get_detailed_results().get('rule_results', {})
+            carried = {}
+            for rule_id, fingerprint in fingerprints.items():
+                previous_result = previous.get(rule_id)
+                if (previous_result and previous_result.get('evidence_fingerprint') == fingerprint
+                        and previous_result['compliance_status'] != 'ERROR'):
+                    carried[rule_id] = previous_result
+            record(carried)
+            work = [item for item in work if item[0] not in carried]
+            print(f"Incremental check: {len(carried)} rules unchanged, {len(work)} to re-evaluate")
+        
+        if batch_rules:
+            # Resolve cached and evidence-less rules first, then group the rest by shared context
+            resolved = {}
+            pending = []
+            for rule_id, rule_data, relevant_docs in work:
+                if self.prescan_resolves(rule_id, relevant_docs):
+                    resolved[rule_id] = self.not_addressed_result(rule_id, rule_data, relevant_docs)
+                    continue
+                if not relevant_docs:
+                    resolved[rule_id] = self.not_found_result(rule_id, rule_data)
+                    continue
+                analysis = self.cached_verdict(rule_id, rule_data, relevant_docs)
+                if analysis is not None:
+                    resolved[rule_id] = self.finalize_result(rule_id, rule_data, analysis, relevant_docs)
+                else:
+                    pending.append((rule_id, rule_data, relevant_docs))
+            record(resolved)
+            
+            def check(items):
+                print(f"Checking rules: {', '.join(rule_data['title'] for _, rule_data, _ in items)}")
+                return self.check_rule_group(items)
+            
+            tasks = self.group_rules(pending)
+        else:
+            def check(item):
+                rule_id, rule_data, relevant_docs = item
+                print(f"Checking rule: {rule_data['title']}")
+                return {rule_id: self.check_rule_compliance(rule_id, rule_data, relevant_docs)}
+            
+            tasks = work
+        
+        if concurrency > 1:
+            # Rules are independent, so evaluate them on a pool sharing one rate limiter
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in as_completed([executor.submit(check, task) for task in tasks]):
+                    record(future.result())
+        else:
+            for task in tasks:
+                record(check(task))
+        
+        # Assemble the results from the log, in rule order regardless of completion order
+        logged = {rule_id: rule_result for (_, rule_id), rule_result in log.results().items()}
+        results['rule_results'] = {rule_id: logged[rule_id] for rule_id in self.rules}
+        results['summary'] = self.summarize(results['rule_results'])
+        results['prescan_resolved'] = self.count_prescan_resolved(results['rule_results'].values())
+        results['cache'] = self.cache.stats()
+        self.cache.evict()
         
         # Add timestamp
         from datetime import datetime
@@ -153,11 +571,118 @@ Respond in this exact JSON format:
         
         # Save results
         os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
-        with open(RESULTS_FILE, 'w') as f:
+        with span('check.write'), open(RESULTS_FILE, 'w') as f:
             json.dump(results, f, indent=2)
+        log.complete()
         
         print(f"\nCompliance check complete!")
         print(f"Results saved to: {RESULTS_FILE}")
+        print(f"Verdict cache: {results['cache']['hits']} hits, {results['cache']['misses']} misses")
+        print(f"Keyword pre-scan: {results['prescan_resolved']} rules resolved without the model")
+        
+        return results
+    
+    @timed('matrix.run', export=True)
+    def run_compliance_matrix(self, filenames: Optional[List[str]] = None, concurrency: Optional[int] = None,
+                              resume: bool = True, progress: Optional[Callable] = None) -> Dict[str, Any]:
+        """Check every rule against each contract separately (documents x rules).
+        
+        Retrieval for a document only scores that document's chunks. Work items are scheduled
+        across a bounded worker pool, and each finished item is appended to the run log so an
+        interrupted run resumes where it stopped. progress(done, total) is called per item.
+        """
+        concurrency = concurrency or LLM_CONCURRENCY
+        filenames = filenames or self.pdf_processor.indexed_files()
+        total = len(filenames) * len(self.rules)
+        
+        results = {
+            'timestamp': None,
+            'run_id': None,
+            'total_documents': len(filenames),
+            'total_rules': len(self.rules),
+            'documents': {filename: {'rule_results': {}, 'summary': {}} for filename in filenames},
+            'summary': {}
+        }
+        
+        # Carry over items finished by an interrupted run
+        log = RunLog()
+        results['run_id'] = log.start('matrix', resume=resume, context=self.run_context(), total=total)
+        completed = {(filename, rule_id) for (filename, rule_id) in log.completed()
+                     if filename in results['documents'] and rule_id in self.rules}
+        done = len(completed)
+        if done:
+            print(f"Resuming compliance matrix: {done}/{total} items already complete")
+        
+        print(f"Starting compliance matrix for {len(filenames)} documents x {len(self.rules)} rules...")
+        
+        def work_items():
+            for filename in filenames:
+                todo = [rule_id for rule_id in self.rules if (filename, rule_id) not in completed]
+                if not todo:
+                    continue
+                
+                # One retrieval pass per document, restricted to its own chunks; rules it finds
+                # nothing for are checked against the document's keyword hits
+                rows = self.pdf_processor.file_rows(filename)
+                queries = [self.build_search_query(self.rules[rule_id]) for rule_id in todo]
+                retrieved = self.retrieve(queries, filename=filename)
+                for rule_id, relevant_docs in zip(todo, retrieved):
+                    yield filename, rule_id, relevant_docs, rows
+        
+        def check(filename, rule_id, relevant_docs, rows):
+            return filename, rule_id, self.check_rule_compliance(rule_id, self.rules[rule_id], relevant_docs, rows)
+        
+        items = work_items()
+        pending = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                # Keep a bounded number of items in flight so retrieved context isn't held for the whole corpus
+                while len(pending) < concurrency * 2:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.add(executor.submit(check, *item))
+                if not pending:
+                    break
+                
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    filename, rule_id, rule_result = future.result()
+                    log.append(rule_id, rule_result, filename=filename)
+                    
+                    done += 1
+                    print(f"[{done}/{total}] {filename}: {rule_result['rule_title']} - {rule_result['compliance_status']}")
+                    if progress is not None:
+                        progress(done, total)
+        
+        # Assemble from the log, ordering rules consistently, and summarize per document and overall
+        for (filename, rule_id), rule_result in log.results().items():
+            if filename in results['documents'] and rule_id in self.rules:
+                results['documents'][filename]['rule_results'][rule_id] = rule_result
+        overall = {}
+        for filename, document in results['documents'].items():
+            document['rule_results'] = {rule_id: document['rule_results'][rule_id] for rule_id in self.rules}
+            document['summary'] = self.summarize(document['rule_results'])
+            for key, count in document['summary'].items():
+                overall[key] = overall.get(key, 0) + count
+        results['summary'] = overall
+        results['prescan_resolved'] = self.count_prescan_resolved(
+            rule_result for document in results['documents'].values() for rule_result in document['rule_results'].values())
+        results['cache'] = self.cache.stats()
+        self.cache.evict()
+        
+        from datetime import datetime
+        results['timestamp'] = datetime.now().isoformat()
+        
+        with span('check.write'), open(MATRIX_RESULTS_FILE, 'w') as f:
+            json.dump(results, f, indent=2)
+        
+        # The run is complete, so the next one starts fresh
+        log.complete()
+        
+        print(f"\nCompliance matrix complete!")
+        print(f"Results saved to: {MATRIX_RESULTS_FILE}")
+        print(f"Keyword pre-scan: {results['prescan_resolved']} items resolved without the model")
         
         return results
     
@@ -196,6 +721,13 @@ Overall Compliance Score: {(summary['compliant'] + summary['partial']*0.5)/total
             return {}
 
 if __name__ == "__main__":
-    checker = ComplianceChecker()
-    results = checker.run_full_compliance_check()
-    print(checker.get_compliance_summary())
\ No newline at end of file
+    import sys
+    
+    checker = ComplianceChecker(backend=OfflineBackend() if '--offline' in sys.argv else None)
+    if '--matrix' in sys.argv:
+        results = checker.run_compliance_matrix(resume='--restart' not in sys.argv)
+        print(f"Matrix summary: {results['summary']}")
+    else:
+        results = checker.run_full_compliance_check(incremental='--incremental' in sys.argv,
+                                                    resume='--restart' not in sys.argv)
+        print(checker.get_compliance_summary())
\ No newline at end of file
@@ -1,29 +1,102 @@
 import os
-import streamlit as st
 
 # Configuration for Policy Compliance Checker
 GEMINI_API_KEY = "Your Api key"
 
-# Try to get from environment or Streamlit secrets
+# Try to get from environment or Streamlit secrets (Streamlit is only imported when needed)
 if not GEMINI_API_KEY:
     try:
+        import streamlit as st
         GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
     except:
         GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# File paths
-DATA_DIR = "data"
+# File paths (COMPLIANCE_DATA_DIR relocates all data, e.g. for benchmarks)
+DATA_DIR = os.getenv("COMPLIANCE_DATA_DIR", "data")
 PDF_DIR = os.path.join(DATA_DIR, "pdfs")
 VECTOR_STORE_DIR = os.path.join(DATA_DIR, "vector_store")
 RULES_FILE = os.path.join(DATA_DIR, "compliance_rules.json")
 RESULTS_FILE = os.path.join(DATA_DIR, "compliance_results.json")
+VERDICT_CACHE_FILE = os.path.join(DATA_DIR, "verdict_cache.sqlite")
+MATRIX_RESULTS_FILE = os.path.join(DATA_DIR, "compliance_matrix.json")
+RUN_LOG_FILE = os.path.join(DATA_DIR, "compliance_runs.jsonl")
+METRICS_REPORT_FILE = os.path.join(DATA_DIR, "metrics.json")
+METRICS_PROMETHEUS_FILE = os.path.join(DATA_DIR, "metrics.prom")
 
 # Model settings
 MODEL_NAME = "gemini-2.5-flash"
+LLM_BACKEND = "gemini"  # "gemini" or "offline" (local stand-in for load tests and CI)
+LLM_CONCURRENCY = 4  # rules evaluated in parallel; 1 runs them sequentially
+LLM_REQUESTS_PER_MINUTE = 60
+LLM_TOKENS_PER_MINUTE = 250000
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE = 2.0  # seconds, doubled on each quota error
+LLM_BACKOFF_MAX = 60.0
+LLM_BATCH_RULES = False  # evaluate rules sharing retrieved chunks in one request
+LLM_BATCH_TOKEN_BUDGET = 6000  # estimated prompt tokens per batched request
+
+# Offline backend settings (simulated model behaviour)
+OFFLINE_LATENCY = 0.5  # seconds per call
+OFFLINE_JITTER = 0.2  # +/- seconds around the latency
+OFFLINE_ERROR_RATE = 0.0  # probability of a simulated quota error (retried with backoff)
+OFFLINE_MALFORMED_RATE = 0.0  # probability of an unparseable response
+OFFLINE_SEED = None  # fix to make latency and errors reproducible
+
+# Context assembly settings
+CONTEXT_CANDIDATES = 8  # chunks retrieved per rule before selection
+CONTEXT_MIN_CHUNKS = 3  # chunks always sent per rule, in MMR order, whatever their size
+CONTEXT_TOKEN_BUDGET = 3000  # estimated tokens of contract text up to which further chunks are added
+CONTEXT_MMR_LAMBDA = 0.7  # 1.0 ranks by relevance only; lower values favour diverse chunks
+
+# Instrumentation settings
+METRICS_ENABLED = True  # record timing spans and counters
+PROFILED_SPANS = ("check.run", "matrix.run", "index.create")  # spans wrapped by a registered profiler
+
+# Run log settings
+RUN_LOG_MAX_RUNS = 20  # finished runs kept in the run log
+
+# Verdict cache settings
+VERDICT_CACHE_ENABLED = True
+VERDICT_CACHE_MAX_ENTRIES = 10000
+VERDICT_CACHE_MAX_AGE_DAYS = 30
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+CLAUSE_ALIGNED_CHUNKS = False  # cut full windows at numbered clause headings and record each chunk's clause in its metadata
+
+# Near-duplicate chunk settings
+DEDUP_CHUNKS = False  # index near-identical chunks (e.g. boilerplate clauses) once, with back-references
+DEDUP_THRESHOLD = 0.9  # estimated Jaccard similarity of word shingles at which chunks are collapsed
+DEDUP_SHINGLE_SIZE = 5  # words per shingle
+DEDUP_NUM_PERM = 128  # MinHash signature length
+DEDUP_BANDS = 16  # LSH bands; more bands make less similar chunks candidates for comparison
+
+# Keyword pre-scan settings
+KEYWORD_PRESCAN = True  # skip the model for rules (or document x rule pairs) with no stemmed keyword hits, reporting NOT_ADDRESSED
+KEYWORD_PRESCAN_MAX_SIMILARITY = 0.2  # ...unless a retrieved chunk scores this much (cosine; BM25 scores are larger); None skips regardless
+KEYWORD_PRESCAN_CONFIDENCE = 0.7  # confidence of such a verdict; keyword matching is lexical, so never certain
+KEYWORD_HITS_PER_CHUNK = 8  # keyword positions kept per rule and chunk
+KEYWORD_MAX_ANCHORS = 10  # keyword positions attached to a rule result as evidence anchors
+
+# Retrieval settings
+RETRIEVAL_ENGINE = "tfidf"  # "tfidf" (full-scan cosine), "bm25" (inverted index) or "dense" (LSA + IVF)
+BM25_K1 = 1.5
+BM25_B = 0.75
+DENSE_DIMENSIONS = 256  # LSA embedding size of the dense engine
+DENSE_IVF_LISTS = 0  # k-means lists of the dense engine's IVF index; 0 picks about 4 * sqrt(chunks)
+DENSE_IVF_PROBES = 16  # lists scanned per query; more is slower but closer to exact search
+DENSE_REFIT_FRACTION = 0.5  # incremental updates reuse the fitted projection until this fraction of rows has been added since
+
+# Indexing settings
+INCREMENTAL_INDEXING = False  # hashed TF-IDF whose IDF is updated in place instead of refitted
+HASHING_FEATURES = 2 ** 20
+INGEST_WORKERS = 1  # processes used to read and chunk documents; 0 uses every CPU
+
+# Sharding settings
+NUM_SHARDS = 1  # vector store shards, assigned by filename hash; 1 keeps a single store
+SHARD_WORKERS = 0  # processes building and searching shards in parallel; 0 uses one per shard up to the CPU count
 
-# Create directories if they don't exist
-os.makedirs(PDF_DIR, exist_ok=True)
-os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
+def ensure_data_dirs():
+    """Create the data directories if they don't exist (not done at import time)"""
+    os.makedirs(PDF_DIR, exist_ok=True)
+    os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
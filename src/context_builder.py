@@ -0,0 +1,99 @@
+from typing import Dict, List
+from retrieval import tokenize
+from rate_limiter import estimate_tokens
+from config import CONTEXT_MIN_CHUNKS, CONTEXT_TOKEN_BUDGET, CONTEXT_MMR_LAMBDA
+
+# Turns the chunks retrieved for a rule into the context sent to the model: candidates are
+# ordered by maximal marginal relevance (relevance minus similarity to what is already chosen),
+# the first CONTEXT_MIN_CHUNKS are always taken and further ones while they fit the token budget,
+# and chunks adjacent in the same file are merged into one passage with their shared overlap
+# written once.
+
+def overlap_length(left_words: List[str], right_words: List[str]) -> int:
+    """Number of words at the end of left that are repeated at the start of right"""
+    if not right_words:
+        return 0
+    first = right_words[0]
+    for i in range(max(0, len(left_words) - len(right_words)), len(left_words)):
+        if left_words[i] == first and left_words[i:] == right_words[:len(left_words) - i]:
+            return len(left_words) - i
+    return 0
+
+def jaccard(a: set, b: set) -> float:
+    """Jaccard similarity of two term sets"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def mmr_order(candidates: List[Dict], mmr_lambda: float = CONTEXT_MMR_LAMBDA) -> List[int]:
+    """Order candidates by maximal marginal relevance, so near-duplicates of chosen chunks sink"""
+    term_sets = [set(tokenize(doc['content'])) for doc in candidates]
+    top = max(doc['similarity'] for doc in candidates) or 1.0
+
+    order = []
+    remaining = list(range(len(candidates)))
+    while remaining:
+        def marginal(i):
+            redundancy = max((jaccard(term_sets[i], term_sets[j]) for j in order), default=0.0)
+            return mmr_lambda * candidates[i]['similarity'] / top - (1.0 - mmr_lambda) * redundancy
+        best = max(remaining, key=marginal)
+        order.append(best)
+        remaining.remove(best)
+    return order
+
+def merge_passages(docs: List[Dict]) -> List[Dict]:
+    """Merge chunks adjacent in the same file into passages, ordered by their best similarity.
+
+    A passage's metadata is that of its first chunk plus the 'chunk_ids' it covers.
+    """
+    passages = []
+    passage_words = []
+    for doc in sorted(docs, key=lambda doc: (doc['metadata']['filename'], doc['metadata']['chunk_id'])):
+        meta = doc['metadata']
+        words = doc['content'].split()
+        last = passages[-1] if passages else None
+
+        if (last is not None and last['metadata']['filename'] == meta['filename']
+                and last['metadata']['chunk_ids'][-1] + 1 == meta['chunk_id']):
+            # Append only the words past the overlap the two windows share
+            words = words[overlap_length(passage_words[-1], words):]
+            passage_words[-1].extend(words)
+            last['content'] = ' '.join(passage_words[-1])
+            last['metadata']['chunk_ids'].append(meta['chunk_id'])
+            last['metadata']['char_count'] = len(last['content'])
+            if 'page_end' in meta:
+                last['metadata']['page_end'] = meta['page_end']
+            last['similarity'] = max(last['similarity'], doc['similarity'])
+        else:
+            passages.append({
+                'content': doc['content'],
+                'metadata': dict(meta, chunk_ids=[meta['chunk_id']]),
+                'similarity': doc['similarity']
+            })
+            passage_words.append(words)
+
+    passages.sort(key=lambda passage: -passage['similarity'])
+    return passages
+
+def context_tokens(passages: List[Dict]) -> int:
+    """Estimated prompt tokens of a set of passages"""
+    return sum(estimate_tokens(passage['content']) for passage in passages)
+
+def assemble_context(candidates: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                     mmr_lambda: float = CONTEXT_MMR_LAMBDA, min_chunks: int = CONTEXT_MIN_CHUNKS) -> List[Dict]:
+    """Select, deduplicate and merge retrieved chunks into passages.
+
+    The budget only limits chunks beyond the first min_chunks, so full-size chunks never
+    reduce the evidence below what a plain top-k search would send.
+    """
+    if not candidates:
+        return []
+
+    order = mmr_order(candidates, mmr_lambda)
+    selected = [candidates[i] for i in order[:min_chunks]]
+    for i in order[min_chunks:]:
+        # Cost is measured after merging, so a chunk next to a chosen one only pays for its new words
+        if context_tokens(merge_passages(selected + [candidates[i]])) <= token_budget:
+            selected.append(candidates[i])
+
+    return merge_passages(selected)
@@ -0,0 +1,115 @@
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config import DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE, DEDUP_NUM_PERM, DEDUP_BANDS
+
+# Near-duplicate chunk detection with MinHash and locality-sensitive hashing. Each chunk is
+# reduced to a signature of DEDUP_NUM_PERM minimum hashes of its word shingles; the fraction of
+# equal positions in two signatures estimates the Jaccard similarity of their shingle sets.
+# Signatures are split into DEDUP_BANDS bands, and only chunks sharing a whole band are compared.
+#
+# A collapsed chunk is indexed once. Its metadata is that of the first copy seen, plus a
+# 'duplicates' list holding the metadata of every other copy (filename, chunk_id, pages, ...).
+
+SHINGLE_WORD = re.compile(r'\w+')
+PRIME = (1 << 31) - 1  # hashes are permuted as (a * x + b) mod PRIME
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """CRC32 hashes of the distinct size-word shingles of text, ignoring case and punctuation"""
+    words = SHINGLE_WORD.findall(text.lower())
+    count = max(1, len(words) - size + 1)
+    hashes = np.fromiter((zlib.crc32(' '.join(words[i:i + size]).encode('utf-8')) for i in range(count)),
+                         dtype=np.uint64, count=count)
+    return np.unique(hashes)
+
+class MinHasher:
+    """Computes MinHash signatures with a fixed, seeded family of hash permutations"""
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.randint(1, PRIME, size=(num_perm, 1)).astype(np.uint64)
+        self.b = rng.randint(0, PRIME, size=(num_perm, 1)).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        return ((self.a * hashes[None, :] + self.b) % PRIME).min(axis=1).astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str]) -> np.ndarray:
+        """Signature matrix with one row per text"""
+        rows = [self.signature(text) for text in texts]
+        return np.vstack(rows) if rows else np.zeros((0, self.num_perm), dtype=np.uint32)
+
+def deduplicate(metadata: List[Dict], signatures: np.ndarray, threshold: float = DEDUP_THRESHOLD,
+                bands: int = DEDUP_BANDS) -> Tuple[List[int], List[Dict]]:
+    """Collapse near-duplicate chunks, returning (canonical rows, their metadata).
+
+    Rows are visited in order, so the first copy of a chunk is the one kept; the metadata of
+    later copies (and any duplicates they already carried) moves to its 'duplicates' list.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    buckets = [{} for _ in range(bands)]
+    canonical = []
+    merged = {}
+
+    for row, signature in enumerate(signatures):
+        keys = [signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes() for band in range(bands)]
+
+        match = None
+        compared = set()
+        for band, key in enumerate(keys):
+            for candidate in buckets[band].get(key, ()):
+                if candidate in compared:
+                    continue
+                compared.add(candidate)
+                if np.mean(signatures[candidate] == signature) >= threshold:
+                    match = candidate
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            canonical.append(row)
+            merged[row] = dict(metadata[row])
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(row)
+        else:
+            copy = dict(metadata[row])
+            carried = copy.pop('duplicates', [])
+            merged[match]['duplicates'] = merged[match].get('duplicates', []) + [copy] + carried
+
+    return canonical, [merged[row] for row in canonical]
+
+def source_files(meta: Dict) -> List[str]:
+    """Files a chunk occurs in: its own and those of its duplicates"""
+    return [meta['filename']] + [copy['filename'] for copy in meta.get('duplicates', ())]
+
+def referenced_files(metadata: Iterable[Dict]) -> List[str]:
+    """Every file with a chunk in metadata, duplicates included, in first-seen order"""
+    return list(dict.fromkeys(filename for meta in metadata for filename in source_files(meta)))
+
+def reference_for(meta: Dict, filename: str) -> Dict:
+    """The metadata of a chunk's copy in filename (the chunk's own if it has none there)"""
+    for copy in meta.get('duplicates', ()):
+        if copy['filename'] == filename:
+            return dict(copy, duplicate_of={'filename': meta['filename'], 'chunk_id': meta['chunk_id']})
+    return meta
+
+def drop_references(meta: Dict, filenames: set) -> Optional[Dict]:
+    """Remove the copies of a chunk in filenames, or return None if no copy is left.
+
+    When the chunk's own file goes, the next remaining copy takes its place; the indexed text
+    stays that of the removed copy, which is near-identical by construction.
+    """
+    copies = [{key: value for key, value in meta.items() if key != 'duplicates'}] + list(meta.get('duplicates', ()))
+    remaining = [copy for copy in copies if copy['filename'] not in filenames]
+    if not remaining:
+        return None
+    if len(remaining) == len(copies):
+        return meta
+    kept = dict(remaining[0])
+    if len(remaining) > 1:
+        kept['duplicates'] = remaining[1:]
+    return kept
@@ -1,7 +1,7 @@
 import json
 import os
 from compliance_checker import ComplianceChecker
-from pdf_processor import PDFProcessor
+from sharded_store import create_processor
 from config import RESULTS_FILE
 
 def run_evaluation():
@@ -13,13 +13,13 @@ def run_evaluation():
     # Initialize system
     print("\n1. Initializing system...")
     try:
-        checker = ComplianceChecker()
-        print("✓ Compliance checker initialized")
-        
-        processor = PDFProcessor()
+        processor = create_processor()
         processor.load_vector_store()
         print("✓ PDF processor and vector store loaded")
         
+        checker = ComplianceChecker(pdf_processor=processor)
+        print("✓ Compliance checker initialized")
+        
     except Exception as e:
         print(f"❌ Error initializing system: {e}")
         return
@@ -87,7 +87,7 @@ def run_evaluation():
         'evaluation_timestamp': results['timestamp'],
         'system_performance': {
             'document_search_success_rate': sum(1 for count in search_results.values() if count > 0) / len(search_results),
-            'total_documents_processed': len(set(meta['filename'] for meta in processor.chunk_metadata)),
+            'total_documents_processed': len(processor.indexed_files()),
             'total_chunks_created': len(processor.document_chunks),
             'compliance_rules_processed': total,
             'successful_rule_analyses': sum(1 for result in results['rule_results'].values() 
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+from config import METRICS_ENABLED, METRICS_REPORT_FILE, METRICS_PROMETHEUS_FILE, PROFILED_SPANS
+
+# Lightweight timing spans and counters shared by ingestion, retrieval and checking.
+# Span names are dotted by stage (ingest.read, search.score, llm.generate, ...); span times
+# include any spans nested inside them. Reports go to JSON and Prometheus text files.
+
+class Metrics:
+    """Thread-safe registry of timing spans and counters"""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.started = time.time()
+        self.profiler = None
+        self.profiled_spans = set(PROFILED_SPANS)
+
+    def record(self, name: str, seconds: float, count: int = 1):
+        """Add count calls taking seconds in total to a span"""
+        with self.lock:
+            stats = self.spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            stats['count'] += count
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds / count if count else 0.0)
+
+    def increment(self, name: str, amount: float = 1):
+        """Add to a counter"""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def span(self, name: str):
+        """Time the enclosed block, inside the profiler when this span is profiled"""
+        if not self.enabled:
+            yield
+            return
+
+        profiler = self.profiler if self.profiler is not None and name in self.profiled_spans else None
+        start = time.perf_counter()
+        try:
+            with profiler(name) if profiler is not None else nullcontext():
+                yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name: str, export: bool = False) -> Callable:
+        """Decorator timing every call of a function as a span, optionally exporting the
+        reports once the call (and so its own span) has finished"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                try:
+                    with self.span(name):
+                        return fn(*args, **kwargs)
+                finally:
+                    if export:
+                        self.export()
+            return wrapper
+        return decorator
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from iterable, timing only the time spent producing items (e.g. lazy reads)"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                if self.enabled:
+                    self.record(name, time.perf_counter() - start)
+                return
+            if self.enabled:
+                self.record(name, time.perf_counter() - start)
+            yield item
+
+    def set_profiler(self, factory: Optional[Callable[[str], Any]], spans: Optional[Iterable[str]] = None):
+        """Run the named spans inside factory(span_name), a context manager such as a sampling
+        profiler session; pass None to remove it. Spans default to PROFILED_SPANS."""
+        self.profiler = factory
+        if spans is not None:
+            self.profiled_spans = set(spans)
+
+    def snapshot(self) -> Dict:
+        """Current spans and counters as plain data"""
+        with self.lock:
+            spans = {name: dict(stats, mean_seconds=stats['total_seconds'] / stats['count'] if stats['count'] else 0.0)
+                     for name, stats in sorted(self.spans.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {
+            'started': self.started,
+            'elapsed_seconds': time.time() - self.started,
+            'spans': spans,
+            'counters': counters
+        }
+
+    def merge(self, snapshot: Dict):
+        """Fold in a snapshot taken elsewhere, e.g. in an ingestion worker process"""
+        for name, stats in snapshot['spans'].items():
+            with self.lock:
+                current = self.spans.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+                current['count'] += stats['count']
+                current['total_seconds'] += stats['total_seconds']
+                current['max_seconds'] = max(current['max_seconds'], stats['max_seconds'])
+        for name, value in snapshot['counters'].items():
+            self.increment(name, value)
+
+    def reset(self):
+        """Clear all spans and counters"""
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def prometheus_text(self) -> str:
+        """Spans and counters in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP compliance_stage_seconds Time spent in each pipeline stage.',
+            '# TYPE compliance_stage_seconds summary'
+        ]
+        for name, stats in snapshot['spans'].items():
+            lines.append(f'compliance_stage_seconds_sum{{stage="{name}"}} {stats["total_seconds"]:.6f}')
+            lines.append(f'compliance_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        lines += [
+            '# HELP compliance_stage_max_seconds Slowest single call of each pipeline stage.',
+            '# TYPE compliance_stage_max_seconds gauge'
+        ]
+        for name, stats in snapshot['spans'].items():
+            lines.append(f'compliance_stage_max_seconds{{stage="{name}"}} {stats["max_seconds"]:.6f}')
+        lines += [
+            '# HELP compliance_events_total Pipeline event counters.',
+            '# TYPE compliance_events_total counter'
+        ]
+        for name, value in snapshot['counters'].items():
+            lines.append(f'compliance_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, report_file: str = METRICS_REPORT_FILE, prometheus_file: str = METRICS_PROMETHEUS_FILE):
+        """Write the JSON run report and the Prometheus text file"""
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+            with open(report_file + '.tmp', 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(report_file + '.tmp', report_file)
+
+            with open(prometheus_file + '.tmp', 'w') as f:
+                f.write(self.prometheus_text())
+            os.replace(prometheus_file + '.tmp', prometheus_file)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+def load_report(report_file: str = METRICS_REPORT_FILE) -> Dict:
+    """Read the last exported run report"""
+    try:
+        with open(report_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Process-wide registry used by the pipeline modules
+METRICS = Metrics()
+span = METRICS.span
+timed = METRICS.timed
+timed_iter = METRICS.timed_iter
+increment = METRICS.increment
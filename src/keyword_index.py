@@ -0,0 +1,222 @@
+import re
+import json
+import hashlib
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from compliance_rules import get_all_rules
+from config import KEYWORD_HITS_PER_CHUNK
+from store_format import save_array, load_array
+
+# Rule keyword hits found once at indexing time. All keywords of all rules are compiled into
+# one Aho-Corasick automaton over lowercased word tokens, so a chunk is scanned in a single
+# pass whatever the number of keywords, with overlapping phrases ("liability" inside
+# "professional liability") all reported. Keyword and text words are reduced to the same stem
+# first, so "acts of God" matches "act of god" and "liable" matches "liability". Hits are stored
+# rule-major as rows of (row, start, end, keyword) with character offsets into the chunk text.
+
+SCAN_WORD = re.compile(r'\w+')
+HIT_COLUMNS = 4  # row, start, end, keyword
+
+# Inflectional and derivational endings, longest first, with their replacements. Stems are
+# deliberately coarse: a spurious hit only sends a rule on to retrieval and the model.
+STEM_VERSION = 1
+STEM_SUFFIXES = (('bilities', 'bl'), ('bility', 'bl'), ('ings', ''), ('able', ''), ('ible', ''),
+                 ('ies', 'y'), ('ied', 'y'), ('ing', ''), ('es', ''), ('ed', ''), ('en', ''), ('ly', ''),
+                 ('s', ''), ('e', ''))
+MIN_STEM = 3
+
+def stem(word: str) -> str:
+    """Crude stem of a lowercase word: the first ending whose removal leaves MIN_STEM letters,
+    then any final e's (so "unforeseeable" and "unforeseen" share "unfores")"""
+    for suffix, replacement in STEM_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            if suffix == 's' and word.endswith('ss'):
+                return word
+            word = word[:-len(suffix)] + replacement
+            break
+    while word.endswith('e') and len(word) > MIN_STEM:
+        word = word[:-1]
+    return word
+
+def rules_fingerprint(rules: Dict) -> str:
+    """Hash of each rule's keywords and the stemmer; hits recorded for other keywords are stale"""
+    payload = json.dumps({'stem': STEM_VERSION,
+                          'keywords': {rule_id: rule['keywords'] for rule_id, rule in rules.items()}}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton matching many stemmed word phrases in one pass over a text"""
+
+    def __init__(self, phrases: Sequence[Sequence[str]]):
+        self.lengths = [len(words) for words in phrases]
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        # Trie of the phrases
+        for phrase_id, words in enumerate(phrases):
+            state = 0
+            for word in words:
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.output[state].append(phrase_id)
+
+        # Failure links in breadth-first order, inheriting the outputs of shorter suffixes
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def scan(self, text: str) -> List[Tuple[int, int, int]]:
+        """(start, end, phrase id) of every phrase occurrence, as character offsets into text"""
+        goto, fail, output, lengths = self.goto, self.fail, self.output, self.lengths
+        hits = []
+        starts = []
+        state = 0
+        for match in SCAN_WORD.finditer(text):
+            word = stem(match.group().lower())
+            starts.append(match.start())
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for phrase_id in output[state]:
+                hits.append((starts[len(starts) - lengths[phrase_id]], match.end(), phrase_id))
+        return hits
+
+class KeywordIndex:
+    """Positions of every rule's keywords in every chunk, for finding rules with no evidence"""
+
+    def __init__(self, rules: Optional[Dict] = None, hits_per_chunk: int = KEYWORD_HITS_PER_CHUNK):
+        rules = rules if rules is not None else get_all_rules()
+        self.rules = rules
+        self.rule_ids = list(rules)
+        self.fingerprint = rules_fingerprint(rules)
+        self.hits_per_chunk = hits_per_chunk
+
+        # Keywords are matched case-insensitively on stemmed word tokens, so "Non-Disclosures" matches "non-disclosure"
+        self.keywords = []
+        phrase_ids = {}
+        self.keyword_rules = []
+        for rule_index, rule in enumerate(rules.values()):
+            for keyword in rule['keywords']:
+                phrase = tuple(stem(word) for word in SCAN_WORD.findall(keyword.lower()))
+                if not phrase:
+                    continue
+                if phrase not in phrase_ids:
+                    phrase_ids[phrase] = len(self.keywords)
+                    self.keywords.append(keyword)
+                    self.keyword_rules.append([])
+                if rule_index not in self.keyword_rules[phrase_ids[phrase]]:
+                    self.keyword_rules[phrase_ids[phrase]].append(rule_index)
+        self.automaton = KeywordAutomaton(list(phrase_ids))
+
+        self.num_rows = 0
+        self.hits = np.zeros((0, HIT_COLUMNS), dtype=np.int32)
+        self.rule_offsets = np.zeros(len(self.rule_ids) + 1, dtype=np.int64)
+
+    def scan(self, chunks: Iterable[str], first_row: int = 0) -> Dict[int, List]:
+        """Hits per rule index for a run of chunks, at most hits_per_chunk per rule and chunk"""
+        by_rule = {}
+        for row, chunk in enumerate(chunks, first_row):
+            per_rule = {}
+            for start, end, keyword in self.automaton.scan(chunk):
+                for rule_index in self.keyword_rules[keyword]:
+                    found = per_rule.setdefault(rule_index, [])
+                    if len(found) < self.hits_per_chunk:
+                        found.append((row, start, end, keyword))
+            for rule_index, found in per_rule.items():
+                by_rule.setdefault(rule_index, []).extend(found)
+        return by_rule
+
+    def _set_hits(self, by_rule: Dict[int, List]):
+        """Lay hits out rule-major, rows ascending within a rule"""
+        lengths = [len(by_rule.get(rule_index, ())) for rule_index in range(len(self.rule_ids))]
+        self.rule_offsets = np.zeros(len(self.rule_ids) + 1, dtype=np.int64)
+        self.rule_offsets[1:] = np.cumsum(lengths)
+        rows = [hit for rule_index in range(len(self.rule_ids)) for hit in sorted(by_rule.get(rule_index, ()))]
+        self.hits = np.array(rows, dtype=np.int32).reshape(-1, HIT_COLUMNS)
+
+    def build(self, chunks: Sequence[str]) -> 'KeywordIndex':
+        """Scan every chunk of the store"""
+        self._set_hits(self.scan(chunks))
+        self.num_rows = len(chunks)
+        return self
+
+    def updated(self, kept_rows: Sequence[int], new_chunks: Sequence[str]) -> 'KeywordIndex':
+        """Index for a store keeping kept_rows (in order) followed by new_chunks, scanning only
+        the new chunks"""
+        position = np.full(self.num_rows, -1, dtype=np.int64)
+        position[np.asarray(kept_rows, dtype=np.int64)] = np.arange(len(kept_rows))
+
+        by_rule = self.scan(new_chunks, first_row=len(kept_rows))
+        for rule_index in range(len(self.rule_ids)):
+            hits = self._rule_hits(rule_index)
+            moved = position[hits[:, 0]] if len(hits) else np.zeros(0, dtype=np.int64)
+            kept = [(int(row), int(start), int(end), int(keyword))
+                    for row, (_, start, end, keyword) in zip(moved, hits) if row >= 0]
+            by_rule[rule_index] = kept + by_rule.get(rule_index, [])
+
+        index = KeywordIndex(self.rules, self.hits_per_chunk)
+        index._set_hits(by_rule)
+        index.num_rows = len(kept_rows) + len(new_chunks)
+        return index
+
+    def _rule_hits(self, rule_index: int) -> np.ndarray:
+        return self.hits[self.rule_offsets[rule_index]:self.rule_offsets[rule_index + 1]]
+
+    def rule_rows(self, rule_id: str) -> np.ndarray:
+        """Rows with at least one hit for the rule, ascending"""
+        return np.unique(self._rule_hits(self.rule_ids.index(rule_id))[:, 0])
+
+    def has_hits(self, rule_id: str, rows: Optional[np.ndarray] = None) -> bool:
+        """Whether any keyword of the rule occurs in the store, or in the given rows"""
+        if rule_id not in self.rule_ids:
+            return True
+        hit_rows = self._rule_hits(self.rule_ids.index(rule_id))[:, 0]
+        if rows is None:
+            return len(hit_rows) > 0
+        
+        # Hit rows are ascending, so each row is looked up by binary search instead of
+        # scanning all of the rule's hits for every document
+        rows = np.asarray(rows)
+        positions = np.searchsorted(hit_rows, rows)
+        found = positions < len(hit_rows)
+        return bool((hit_rows[positions[found]] == rows[found]).any())
+
+    def row_hits(self, rule_id: str, row: int) -> List[Tuple[int, int, str]]:
+        """(start, end, keyword) of the rule's keywords in one chunk"""
+        if rule_id not in self.rule_ids:
+            return []
+        hits = self._rule_hits(self.rule_ids.index(rule_id))
+        first, last = np.searchsorted(hits[:, 0], [row, row + 1])
+        return [(int(start), int(end), self.keywords[keyword]) for _, start, end, keyword in hits[first:last]]
+
+    def save(self, store_dir: str) -> Dict:
+        """Write the hit arrays, returning the parameters to record in the store info"""
+        save_array(store_dir, 'keyword_hits', self.hits)
+        save_array(store_dir, 'keyword_rule_offsets', self.rule_offsets)
+        return {'rules': self.rule_ids, 'fingerprint': self.fingerprint, 'num_rows': self.num_rows,
+                'hits_per_chunk': self.hits_per_chunk}
+
+    @classmethod
+    def load(cls, store_dir: str, info: Optional[Dict], rules: Optional[Dict] = None) -> Optional['KeywordIndex']:
+        """Open saved hits memory-mapped, or return None if they were recorded for other rule keywords"""
+        index = cls(rules)
+        if info is None or info['fingerprint'] != index.fingerprint or info['rules'] != index.rule_ids:
+            return None
+        index.hits = load_array(store_dir, 'keyword_hits')
+        index.rule_offsets = load_array(store_dir, 'keyword_rule_offsets')
+        index.num_rows = info['num_rows']
+        index.hits_per_chunk = info['hits_per_chunk']
+        return index
@@ -0,0 +1,124 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+from config import (GEMINI_API_KEY, MODEL_NAME, LLM_BACKEND, OFFLINE_LATENCY, OFFLINE_JITTER,
+                    OFFLINE_ERROR_RATE, OFFLINE_MALFORMED_RATE, OFFLINE_SEED)
+
+# Model backends selectable through LLM_BACKEND in config.py
+LLM_BACKENDS = ('gemini', 'offline')
+
+STATUSES = ('COMPLIANT', 'PARTIAL', 'NON_COMPLIANT', 'NOT_ADDRESSED')
+
+class QuotaExceededError(Exception):
+    """Simulated rate/quota limit, retried by call_with_backoff like the real API errors"""
+
+class LLMBackend(ABC):
+    """Interface of a text generation backend: prompt in, response text out"""
+
+    model_name = None
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Response text for one prompt"""
+
+    async def agenerate(self, prompt: str) -> str:
+        """Generate without blocking the event loop (runs generate on a worker thread by default)"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.generate, prompt)
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini through the google-generativeai client"""
+
+    def __init__(self, model_name: str = MODEL_NAME, api_key: str = GEMINI_API_KEY):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+class OfflineBackend(LLMBackend):
+    """Local stand-in returning schema-valid verdicts, for load tests and runs without API access.
+
+    Verdicts are derived from a hash of the prompt, so the same prompt always gets the same
+    answer. Each call sleeps for latency +/- jitter seconds, raises QuotaExceededError with
+    probability error_rate and returns unparseable text with probability malformed_rate.
+    """
+
+    model_name = 'offline'
+
+    def __init__(self, latency: float = OFFLINE_LATENCY, jitter: float = OFFLINE_JITTER,
+                 error_rate: float = OFFLINE_ERROR_RATE, malformed_rate: float = OFFLINE_MALFORMED_RATE,
+                 seed: Optional[int] = OFFLINE_SEED):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _draw(self):
+        """Delay and failure draws for one call (the shared generator is not thread-safe)"""
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            return delay, self.random.random(), self.random.random()
+
+    def verdict(self, prompt: str, rule_id: Optional[str] = None) -> dict:
+        """Deterministic verdict for a prompt (and rule, in batched prompts)"""
+        digest = hashlib.sha256(f'{rule_id}:{prompt}'.encode('utf-8')).digest()
+        status = STATUSES[digest[0] % len(STATUSES)]
+        context = prompt.split('Policy Documents Context:', 1)[-1].strip()
+        verdict = {
+            'compliance_status': status,
+            'confidence': round(0.5 + digest[1] / 510, 2),
+            'evidence': [context[:160]] if context and status != 'NOT_ADDRESSED' else [],
+            'suggestions': [] if status == 'COMPLIANT' else ['Review this clause against the rule requirements.']
+        }
+        if rule_id is not None:
+            verdict = dict(rule_id=rule_id, **verdict)
+        return verdict
+
+    def respond(self, prompt: str) -> str:
+        """Response text: an array of verdicts for batched prompts, one verdict object otherwise"""
+        rule_ids = re.findall(r'^Rule ID: (\S+)', prompt, flags=re.MULTILINE)
+        if rule_ids:
+            return json.dumps([self.verdict(prompt, rule_id) for rule_id in rule_ids], indent=2)
+        return json.dumps(self.verdict(prompt), indent=2)
+
+    def _complete(self, prompt: str, error_draw: float, malformed_draw: float) -> str:
+        if error_draw < self.error_rate:
+            raise QuotaExceededError('429 simulated quota exceeded')
+        if malformed_draw < self.malformed_rate:
+            return 'The documents could not be analyzed.'
+        return self.respond(prompt)
+
+    def generate(self, prompt: str) -> str:
+        delay, error_draw, malformed_draw = self._draw()
+        time.sleep(delay)
+        return self._complete(prompt, error_draw, malformed_draw)
+
+    async def agenerate(self, prompt: str) -> str:
+        delay, error_draw, malformed_draw = self._draw()
+        await asyncio.sleep(delay)
+        return self._complete(prompt, error_draw, malformed_draw)
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    """Instantiate the backend selected by name"""
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'offline':
+        return OfflineBackend()
+    raise ValueError(f"Unknown LLM backend '{name}', expected one of {LLM_BACKENDS}")
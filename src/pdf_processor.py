@@ -1,18 +1,107 @@
 import os
 import json
-import requests
-from typing import List, Dict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import pickle
+import hashlib
+from typing import List, Dict, Optional, Iterator, Tuple
+import uuid
 import numpy as np
-from config import PDF_DIR, VECTOR_STORE_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+from concurrent.futures import ProcessPoolExecutor
+from config import (PDF_DIR, VECTOR_STORE_DIR, CHUNK_SIZE, CHUNK_OVERLAP, RETRIEVAL_ENGINE,
+                    INCREMENTAL_INDEXING, INGEST_WORKERS, DEDUP_CHUNKS, DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE,
+                    DEDUP_NUM_PERM, DEDUP_BANDS, ensure_data_dirs)
+from retrieval import BM25Index, DenseIndex, IncrementalTfidfVectorizer, RETRIEVAL_ENGINES, top_k_indices
+from store_format import (save_array, load_array, save_json, load_json, save_csr, load_csr,
+                          remove_files, build_info)
+from chunker import TextChunker
+from dedup import MinHasher, deduplicate, source_files, referenced_files, reference_for, drop_references
+from keyword_index import KeywordIndex
+from chunk_store import write_chunk_store, ChunkTextView, ChunkMetadataView
+from instrumentation import METRICS, span, timed, timed_iter, increment
+
+# store_info.json is rewritten last on every build, so it versions the whole store
+STORE_FILES = ['store_info.json']
+LEGACY_STORE_FILES = ['vectorizer.pkl', 'tfidf_matrix.pkl', 'bm25_index.pkl', 'counts_matrix.pkl', 'documents.json']
+
+TFIDF_PARAMS = dict(
+    max_features=5000,
+    stop_words='english',
+    ngram_range=(1, 2),
+    min_df=1,
+    max_df=0.95
+)
+
+def make_tfidf_vectorizer():
+    """TfidfVectorizer with the store's parameters; scikit-learn is imported on first use"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(**TFIDF_PARAMS)
+
+def get_store_version(store_dir: str = VECTOR_STORE_DIR) -> Optional[str]:
+    """Return a version string for the vector store on disk, or None if it is incomplete"""
+    signature = []
+    for name in STORE_FILES:
+        try:
+            stat = os.stat(os.path.join(store_dir, name))
+        except FileNotFoundError:
+            return None
+        signature.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1('|'.join(signature).encode('utf-8')).hexdigest()[:16]
+
+def shard_of(filename: str, num_shards: int) -> int:
+    """Shard a document belongs to, from a stable hash of its filename"""
+    return int(hashlib.md5(filename.encode('utf-8')).hexdigest(), 16) % num_shards
+
+def file_sha256(filepath: str) -> str:
+    """Hash a file's contents without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(store_dir: str = VECTOR_STORE_DIR) -> Optional[Dict]:
+    """Load the file manifest recorded with the vector store"""
+    try:
+        with open(os.path.join(store_dir, 'manifest.json'), 'r') as f:
+            return json.load(f)['files']
+    except FileNotFoundError:
+        return None
+
+def iter_pdf_pages(filepath: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) for each page of a PDF, extracting one page at a time"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError("PDF support requires pypdf: pip install pypdf")
+    
+    with open(filepath, 'rb') as f:
+        reader = PdfReader(f)
+        for page_number, page in enumerate(reader.pages, start=1):
+            yield page_number, page.extract_text() or ''
 
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, engine: str = RETRIEVAL_ENGINE, store_dir: str = VECTOR_STORE_DIR,
+                 shard: Optional[Tuple[int, int]] = None, incremental: bool = INCREMENTAL_INDEXING):
+        # With shard=(index, count), only the documents shard_of assigns to that shard are indexed
+        if engine not in RETRIEVAL_ENGINES:
+            raise ValueError(f"Unknown retrieval engine '{engine}', expected one of {RETRIEVAL_ENGINES}")
+        if engine == 'dense' and incremental:
+            # The LSA projection has a column per feature: about 1 GB for the 2^20 hashed features
+            raise ValueError("The dense engine needs the fitted TF-IDF vocabulary; "
+                             "it cannot be combined with hashed features (INCREMENTAL_INDEXING or sharding)")
+        ensure_data_dirs()
+        self.engine = engine
+        self.store_dir = store_dir
+        self.shard = shard
+        self.incremental = incremental
         self.vectorizer = None
+        self.tfidf_matrix = None
+        self.bm25_index = None
+        self.dense_index = None
+        self.index_version = None
         self.document_chunks = []
         self.chunk_metadata = []
+        self.chunker = TextChunker()
+        self.minhash_signatures = None
+        self.keyword_index = None
         
     def download_cuad_contracts(self):
         """Create sample legal contract documents based on CUAD dataset structure"""
@@ -264,154 +353,545 @@ Confidentiality, audit, and indemnification provisions survive termination.
     
     def chunk_text(self, text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
         """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk = ' '.join(chunk_words)
-            if len(chunk.strip()) > 0:
-                chunks.append(chunk)
-                
-        return chunks
+        return [chunk.text for chunk in TextChunker(chunk_size, overlap).chunk_text(text)]
     
-    def process_documents(self) -> Dict:
-        """Process all documents in the PDF directory"""
+    def chunking_info(self) -> Dict:
+        """Chunking and deduplication settings recorded with the store"""
+        return {
+            'chunk_size': self.chunker.chunk_size,
+            'overlap': self.chunker.chunk_size - self.chunker.step,
+            'align_clauses': self.chunker.align_clauses,
+            'dedup': [DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE, DEDUP_NUM_PERM, DEDUP_BANDS] if DEDUP_CHUNKS else None
+        }
+    
+    def list_documents(self) -> List[str]:
+        """List supported document files in the PDF directory in a stable order"""
+        documents = sorted(f for f in os.listdir(PDF_DIR) if f.endswith(('.txt', '.pdf')))
+        if self.shard is not None:
+            index, count = self.shard
+            documents = [f for f in documents if shard_of(f, count) == index]
+        return documents
+    
+    def process_file(self, filename: str):
+        """Read and chunk a single document, returning its chunks and chunk metadata"""
+        filepath = os.path.join(PDF_DIR, filename)
+        is_pdf = filename.endswith('.pdf')
+        
+        if is_pdf:
+            # Pages are extracted lazily, so ingest.chunk includes the ingest.read time of each page
+            chunks = self.chunker.chunk_pages(timed_iter('ingest.read', iter_pdf_pages(filepath)))
+        else:
+            with span('ingest.read'), open(filepath, 'r', encoding='utf-8') as f:
+                content = f.read()
+            chunks = self.chunker.chunk_text(content)
+        
+        # Only the chunk texts and their metadata are kept, filled in as the chunker yields them;
+        # the document's chunks are held until it is indexed, since the vectorizer is fit on all of them
+        texts = []
+        metadata = []
+        with span('ingest.chunk'):
+            for chunk in chunks:
+                meta = {
+                    'filename': filename,
+                    'chunk_id': len(texts),
+                    'char_count': len(chunk.text)
+                }
+                if is_pdf:
+                    meta['page_start'] = chunk.page_start
+                    meta['page_end'] = chunk.page_end
+                if chunk.clause_number is not None:
+                    meta['clause_number'] = chunk.clause_number
+                    meta['clause_title'] = chunk.clause_title
+                texts.append(chunk.text)
+                metadata.append(meta)
+        
+        for meta in metadata:
+            meta['total_chunks'] = len(texts)
+        return texts, metadata
+    
+    def ingest_files(self, filenames: List[str], workers: Optional[int] = None):
+        """Read and chunk files, in parallel when workers > 1.
+        
+        Results are merged in the order of filenames so chunk ids stay stable, and a
+        failing file is reported instead of aborting the batch.
+        Returns (chunks, metadata, failures).
+        """
+        workers = INGEST_WORKERS if workers is None else workers
+        workers = workers or os.cpu_count() or 1
+        
+        if workers > 1 and len(filenames) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(filenames))) as executor:
+                outcomes = []
+                for outcome, worker_metrics in executor.map(ingest_file_with_metrics, filenames,
+                                                            chunksize=max(1, len(filenames) // (workers * 4))):
+                    outcomes.append(outcome)
+                    METRICS.merge(worker_metrics)
+        else:
+            outcomes = [ingest_file(filename) for filename in filenames]
+        
         documents = []
         metadata = []
+        failures = []
+        for filename, chunks, chunk_metadata, error in outcomes:
+            if error is not None:
+                print(f"Error processing {filename}: {error}")
+                failures.append({'filename': filename, 'error': error})
+                continue
+            
+            documents.extend(chunks)
+            metadata.extend(chunk_metadata)
+            increment('ingest.files')
+            increment('ingest.chunks', len(chunks))
+            print(f"Processed {filename}: {len(chunks)} chunks")
         
+        return documents, metadata, failures
+    
+    def process_documents(self, workers: Optional[int] = None) -> Dict:
+        """Process all documents in the PDF directory"""
         # Check if we have documents, if not create samples
         if not os.path.exists(PDF_DIR) or not os.listdir(PDF_DIR):
             print("No documents found, creating CUAD contract documents...")
             self.download_cuad_contracts()
         
         # Process each document
-        for filename in os.listdir(PDF_DIR):
-            if filename.endswith(('.txt', '.pdf')):
-                filepath = os.path.join(PDF_DIR, filename)
-                
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    # Create chunks
-                    chunks = self.chunk_text(content)
-                    
-                    for i, chunk in enumerate(chunks):
-                        documents.append(chunk)
-                        metadata.append({
-                            'filename': filename,
-                            'chunk_id': i,
-                            'total_chunks': len(chunks),
-                            'char_count': len(chunk)
-                        })
-                    
-                    print(f"Processed {filename}: {len(chunks)} chunks")
-                    
-                except Exception as e:
-                    print(f"Error processing {filename}: {e}")
+        documents, metadata, failures = self.ingest_files(self.list_documents(), workers)
+        
+        ingested = len(documents)
+        if DEDUP_CHUNKS:
+            documents, metadata = self.deduplicate_chunks(documents, metadata)
         
         self.document_chunks = documents
         self.chunk_metadata = metadata
         
+        files = referenced_files(metadata)
         return {
-            'total_documents': len(set(meta['filename'] for meta in metadata)),
+            'total_documents': len(files),
             'total_chunks': len(documents),
-            'processed_files': list(set(meta['filename'] for meta in metadata))
+            'duplicate_chunks': ingested - len(documents),
+            'processed_files': files,
+            'failed_files': failures
         }
     
+    def deduplicate_chunks(self, chunks: List[str], metadata: List[Dict], signatures: Optional[np.ndarray] = None):
+        """Collapse near-duplicate chunks, keeping the signatures of the remaining ones for
+        later incremental updates. Returns (chunks, metadata)."""
+        with span('ingest.dedup'):
+            if signatures is None:
+                signatures = MinHasher().signatures(chunks)
+            rows, metadata = deduplicate(metadata, signatures)
+        self.minhash_signatures = signatures[rows]
+        increment('ingest.duplicate_chunks', len(chunks) - len(rows))
+        return [chunks[row] for row in rows], metadata
+    
+    def scan_documents(self, manifest: Optional[Dict] = None) -> Dict[str, Dict]:
+        """Build manifest entries for the PDF directory, hashing only files whose size or mtime changed"""
+        manifest = manifest or {}
+        entries = {}
+        
+        for filename in self.list_documents():
+            filepath = os.path.join(PDF_DIR, filename)
+            stat = os.stat(filepath)
+            previous = manifest.get(filename)
+            
+            if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+                content_hash = previous['sha256']
+            else:
+                content_hash = file_sha256(filepath)
+            
+            entries[filename] = {
+                'path': filepath,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'sha256': content_hash
+            }
+        
+        return entries
+    
+    @timed('index.fit')
+    def fit_vectors(self):
+        """Fit the vectorizer on the current chunks, returning (tfidf matrix, raw counts or None)"""
+        if self.incremental:
+            self.vectorizer = IncrementalTfidfVectorizer()
+            return self.vectorizer.fit_transform(self.document_chunks)
+        
+        # Create TF-IDF vectorizer
+        self.vectorizer = make_tfidf_vectorizer()
+        
+        # Fit and transform documents
+        return self.vectorizer.fit_transform(self.document_chunks), None
+    
+    @timed('index.create', export=True)
     def create_vector_store(self):
         """Create TF-IDF vector store from processed documents"""
         if not self.document_chunks:
             self.process_documents()
         
-        # Create TF-IDF vectorizer
-        self.vectorizer = TfidfVectorizer(
-            max_features=5000,
-            stop_words='english',
-            ngram_range=(1, 2),
-            min_df=1,
-            max_df=0.95
-        )
+        tfidf_matrix, counts = self.fit_vectors()
         
-        # Fit and transform documents
-        tfidf_matrix = self.vectorizer.fit_transform(self.document_chunks)
+        # Files that failed to process are left out of the manifest so the next update retries them
+        indexed_files = set(referenced_files(self.chunk_metadata))
+        manifest = {f: entry for f, entry in self.scan_documents().items() if f in indexed_files}
+        self.save_vector_store(tfidf_matrix, counts, manifest)
         
-        # Save vector store
-        os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+        print(f"Vector store created with {len(self.document_chunks)} chunks")
+        return tfidf_matrix
+    
+    @timed('index.keywords')
+    def build_keyword_index(self) -> KeywordIndex:
+        """Scan every chunk for the keywords of the compliance rules"""
+        return KeywordIndex().build(self.document_chunks)
+    
+    @timed('index.save')
+    def save_vector_store(self, tfidf_matrix, counts=None, manifest: Optional[Dict] = None,
+                          keyword_index: Optional[KeywordIndex] = None, dense_index: Optional[DenseIndex] = None):
+        """Write the vectorizer, matrix, chunks, keyword hits and manifest to the vector store directory.
         
-        # Save vectorizer
-        with open(os.path.join(VECTOR_STORE_DIR, 'vectorizer.pkl'), 'wb') as f:
-            pickle.dump(self.vectorizer, f)
+        The keyword hit and dense indexes are built from the chunks unless up-to-date ones are passed.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
         
-        # Save TF-IDF matrix
-        with open(os.path.join(VECTOR_STORE_DIR, 'tfidf_matrix.pkl'), 'wb') as f:
-            pickle.dump(tfidf_matrix, f)
+        # Save vectorizer as its vocabulary and IDF weights
+        if isinstance(self.vectorizer, IncrementalTfidfVectorizer):
+            vectorizer_info = self.vectorizer.save(self.store_dir)
+        else:
+            save_json(self.store_dir, 'vocabulary.json', {term: int(col) for term, col in self.vectorizer.vocabulary_.items()})
+            save_array(self.store_dir, 'idf', self.vectorizer.idf_)
+            vectorizer_info = {'type': 'tfidf'}
         
-        # Save documents and metadata
-        with open(os.path.join(VECTOR_STORE_DIR, 'documents.json'), 'w') as f:
-            json.dump({
-                'chunks': self.document_chunks,
-                'metadata': self.chunk_metadata
-            }, f, indent=2)
+        # Save TF-IDF matrix as raw CSR arrays
+        tfidf_shape = save_csr(self.store_dir, 'tfidf', tfidf_matrix)
         
-        print(f"Vector store created with {len(self.document_chunks)} chunks")
-        return tfidf_matrix
+        # Raw counts let an incremental update drop rows and re-weight without re-tokenizing
+        counts_shape = None
+        if counts is not None:
+            counts_shape = save_csr(self.store_dir, 'counts', counts)
+        else:
+            remove_files(self.store_dir, ['counts_data.npy', 'counts_indices.npy', 'counts_indptr.npy'])
+        
+        # Save documents and metadata as an offset-indexed chunk store
+        write_chunk_store(self.store_dir, self.document_chunks, self.chunk_metadata)
+        
+        # MinHash signatures let an incremental update deduplicate new chunks against the store
+        if DEDUP_CHUNKS:
+            if self.minhash_signatures is None or len(self.minhash_signatures) != len(self.document_chunks):
+                self.minhash_signatures = MinHasher().signatures(self.document_chunks)
+            save_array(self.store_dir, 'minhash', self.minhash_signatures)
+        else:
+            remove_files(self.store_dir, ['minhash.npy'])
+        
+        # Record where each rule's keywords occur, for the checker's no-evidence fast path
+        if keyword_index is None:
+            keyword_index = self.build_keyword_index()
+        self.keyword_index = keyword_index
+        keywords_info = keyword_index.save(self.store_dir)
+        
+        # Build the inverted index when BM25 retrieval is selected
+        bm25_info = None
+        if self.engine == 'bm25':
+            self.bm25_index = BM25Index().build(self.document_chunks)
+            bm25_info = self.bm25_index.save(self.store_dir)
+        
+        # Project the TF-IDF rows into the LSA space when dense retrieval is selected
+        dense_info = None
+        if self.engine == 'dense':
+            if dense_index is None:
+                with span('index.dense'):
+                    dense_index = DenseIndex().build(tfidf_matrix)
+            self.dense_index = dense_index
+            dense_info = self.dense_index.save(self.store_dir)
+        
+        # Record what was indexed so later runs can update incrementally
+        if manifest is not None:
+            with open(os.path.join(self.store_dir, 'manifest.json'), 'w') as f:
+                json.dump({'files': manifest}, f, indent=2)
+        
+        remove_files(self.store_dir, LEGACY_STORE_FILES)
+        save_json(self.store_dir, 'store_info.json', build_info(
+            build_id=uuid.uuid4().hex,
+            num_chunks=len(self.document_chunks),
+            vectorizer=vectorizer_info,
+            tfidf_shape=tfidf_shape,
+            counts_shape=counts_shape,
+            bm25=bm25_info,
+            dense=dense_info,
+            chunking=self.chunking_info(),
+            keywords=keywords_info
+        ))
+        
+        # Keep the index resident for subsequent searches, and serve chunks from the chunk store
+        # just written, as after a load, so per-file lookups use its row index
+        self.tfidf_matrix = tfidf_matrix
+        self.document_chunks = ChunkTextView(self.store_dir)
+        self.chunk_metadata = ChunkMetadataView(self.store_dir)
+        self.index_version = get_store_version(self.store_dir)
     
+    @timed('index.update', export=True)
+    def update_vector_store(self) -> Dict:
+        """Re-index only new, changed and deleted files using the manifest in the vector store"""
+        manifest = load_manifest(self.store_dir)
+        if manifest is None or get_store_version(self.store_dir) is None:
+            print("No manifest found, building the full vector store...")
+            manifest = None
+        elif load_json(self.store_dir, 'store_info.json').get('chunking') != self.chunking_info():
+            # Chunks of unchanged files would not match the new chunking settings
+            print("Chunking settings changed, rebuilding the full vector store...")
+            manifest = None
+        if manifest is None:
+            self.document_chunks = []
+            self.create_vector_store()
+            return {'added': len(referenced_files(self.chunk_metadata)), 'changed': 0, 'removed': 0}
+        
+        self.ensure_index()
+        entries = self.scan_documents(manifest)
+        
+        added = [f for f in entries if f not in manifest]
+        changed = [f for f in entries if f in manifest and entries[f]['sha256'] != manifest[f]['sha256']]
+        removed = [f for f in manifest if f not in entries]
+        summary = {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+        
+        if not (added or changed or removed):
+            # Refresh recorded mtimes so the next scan can skip hashing
+            with open(os.path.join(self.store_dir, 'manifest.json'), 'w') as f:
+                json.dump({'files': entries}, f, indent=2)
+            print("Vector store is up to date")
+            return summary
+        
+        # Drop chunks of changed and deleted files; a collapsed chunk stays while any copy remains
+        stale = set(changed) | set(removed)
+        kept_metadata = [drop_references(meta, stale) for meta in self.chunk_metadata]
+        keep_rows = [i for i, meta in enumerate(kept_metadata) if meta is not None]
+        
+        # Chunk only new and changed files
+        new_chunks, new_metadata, failures = self.ingest_files(added + changed)
+        for failure in failures:
+            entries.pop(failure['filename'])
+        
+        chunks = [self.document_chunks[i] for i in keep_rows] + new_chunks
+        metadata = [kept_metadata[i] for i in keep_rows] + new_metadata
+        rows = list(range(len(chunks)))
+        if DEDUP_CHUNKS:
+            # New chunks that repeat indexed ones become back-references instead of rows
+            signatures = np.vstack([load_array(self.store_dir, 'minhash')[keep_rows],
+                                    MinHasher().signatures(new_chunks)])
+            with span('ingest.dedup'):
+                rows, metadata = deduplicate(metadata, signatures)
+            self.minhash_signatures = signatures[rows]
+            chunks = [chunks[row] for row in rows]
+        
+        self.document_chunks = chunks
+        self.chunk_metadata = metadata
+        
+        # Stored rows carried over (old row numbers, in order) and the new chunks appended after them
+        surviving_rows = [keep_rows[row] for row in rows if row < len(keep_rows)]
+        added_chunks = [new_chunks[row - len(keep_rows)] for row in rows if row >= len(keep_rows)]
+        
+        # Carry keyword hits over and scan only the added chunks
+        keyword_index = None
+        if self.keyword_index is not None and self.keyword_index.num_rows == len(kept_metadata):
+            with span('index.keywords'):
+                keyword_index = self.keyword_index.updated(surviving_rows, added_chunks)
+        
+        # The fitted vocabulary, to carry the dense projection over to the refitted vectorizer
+        fitted_vocabulary = getattr(self.vectorizer, 'vocabulary_', None)
+        
+        counts_shape = load_json(self.store_dir, 'store_info.json')['counts_shape']
+        if isinstance(self.vectorizer, IncrementalTfidfVectorizer) and self.incremental and counts_shape:
+            counts = load_csr(self.store_dir, 'counts', counts_shape)
+            drop_rows = sorted(set(range(counts.shape[0])) - set(surviving_rows))
+            
+            # Maintain document frequencies instead of refitting the vectorizer
+            self.vectorizer.remove_counts(counts[drop_rows])
+            added_counts = self.vectorizer.count(added_chunks)
+            self.vectorizer.add_counts(added_counts)
+            import scipy.sparse as sp
+            counts = sp.vstack([counts[surviving_rows], added_counts]).tocsr()
+            tfidf_matrix = self.vectorizer.weight(counts)
+        else:
+            tfidf_matrix, counts = self.fit_vectors()
+        
+        # Reuse the dense projection and lists, embedding only the added chunks, until a refit is due
+        dense_index = None
+        if (self.engine == 'dense' and self.dense_index is not None and fitted_vocabulary is not None
+                and len(self.dense_index.embeddings) == len(kept_metadata)
+                and not self.dense_index.needs_refit(len(added_chunks))):
+            columns = np.full(tfidf_matrix.shape[1], -1, dtype=np.int64)
+            for term, column in self.vectorizer.vocabulary_.items():
+                columns[column] = fitted_vocabulary.get(term, -1)
+            with span('index.dense'):
+                dense_index = self.dense_index.updated(surviving_rows, tfidf_matrix, columns)
+        
+        self.save_vector_store(tfidf_matrix, counts, entries, keyword_index, dense_index)
+        
+        print(f"Vector store updated: {summary['added']} added, {summary['changed']} changed, "
+              f"{summary['removed']} removed ({len(self.document_chunks)} chunks)")
+        return summary
+    
+    @timed('index.load')
     def load_vector_store(self):
         """Load existing vector store"""
         try:
+            info = load_json(self.store_dir, 'store_info.json')
+            
             # Load vectorizer
-            with open(os.path.join(VECTOR_STORE_DIR, 'vectorizer.pkl'), 'rb') as f:
-                self.vectorizer = pickle.load(f)
+            if info['vectorizer']['type'] == 'hashed':
+                self.vectorizer = IncrementalTfidfVectorizer.load(self.store_dir, info['vectorizer'])
+            else:
+                self.vectorizer = make_tfidf_vectorizer()
+                self.vectorizer.vocabulary_ = load_json(self.store_dir, 'vocabulary.json')
+                self.vectorizer.idf_ = load_array(self.store_dir, 'idf', mmap=False)
+            
+            # Open TF-IDF matrix memory-mapped
+            tfidf_matrix = load_csr(self.store_dir, 'tfidf', info['tfidf_shape'])
+            
+            # Open documents and metadata as lazy views over the chunk store
+            self.document_chunks = ChunkTextView(self.store_dir)
+            self.chunk_metadata = ChunkMetadataView(self.store_dir)
+            
+            # Keyword hits are rebuilt in memory if the rule keywords changed since the store was built
+            self.keyword_index = KeywordIndex.load(self.store_dir, info.get('keywords'))
+            if self.keyword_index is None:
+                print("Keyword index missing or out of date, rescanning chunks...")
+                self.keyword_index = self.build_keyword_index()
             
-            # Load TF-IDF matrix
-            with open(os.path.join(VECTOR_STORE_DIR, 'tfidf_matrix.pkl'), 'rb') as f:
-                tfidf_matrix = pickle.load(f)
+            # Load inverted index
+            if self.engine == 'bm25':
+                if info['bm25'] is None:
+                    raise FileNotFoundError("Vector store has no BM25 index")
+                self.bm25_index = BM25Index.load(self.store_dir, info['bm25'])
             
-            # Load documents and metadata
-            with open(os.path.join(VECTOR_STORE_DIR, 'documents.json'), 'r') as f:
-                data = json.load(f)
-                self.document_chunks = data['chunks']
-                self.chunk_metadata = data['metadata']
+            # Load dense embeddings and their IVF lists
+            if self.engine == 'dense':
+                if info.get('dense') is None:
+                    raise FileNotFoundError("Vector store has no dense index")
+                self.dense_index = DenseIndex.load(self.store_dir, info['dense'])
+            
+            self.tfidf_matrix = tfidf_matrix
+            self.index_version = get_store_version(self.store_dir)
             
             return tfidf_matrix
         
         except FileNotFoundError:
+            # Views opened before the failure would otherwise be refit as if they were fresh
+            # chunks, and the new manifest would mark the documents' current contents indexed
             print("Vector store not found, creating new one...")
+            self.document_chunks = []
+            self.chunk_metadata = []
+            self.minhash_signatures = None
+            self.keyword_index = None
             return self.create_vector_store()
     
-    def search_documents(self, query: str, k: int = 5):
+    def ensure_index(self):
+        """Return the resident TF-IDF matrix, reloading only if the store on disk changed"""
+        if self.tfidf_matrix is None or self.vectorizer is None:
+            return self.load_vector_store()
+        
+        if self.engine == 'bm25' and self.bm25_index is None:
+            return self.load_vector_store()
+        
+        if self.engine == 'dense' and self.dense_index is None:
+            return self.load_vector_store()
+        
+        if get_store_version(self.store_dir) != self.index_version:
+            print("Vector store changed on disk, reloading...")
+            return self.load_vector_store()
+        
+        return self.tfidf_matrix
+    
+    def indexed_files(self) -> List[str]:
+        """Filenames that have chunks in the loaded index, in index order"""
+        self.ensure_index()
+        if isinstance(self.chunk_metadata, ChunkMetadataView):
+            return list(self.chunk_metadata.filenames)
+        return referenced_files(self.chunk_metadata)
+    
+    def file_rows(self, filename: str) -> np.ndarray:
+        """Index rows holding the chunks of one file, including collapsed duplicates of them"""
+        self.ensure_index()
+        if isinstance(self.chunk_metadata, ChunkMetadataView):
+            return self.chunk_metadata.rows_for_file(filename)
+        return np.array([i for i, meta in enumerate(self.chunk_metadata) if filename in source_files(meta)], dtype=np.int64)
+    
+    def search_documents(self, query: str, k: int = 5, filename: Optional[str] = None):
         """Search for relevant document chunks"""
-        if self.vectorizer is None:
-            tfidf_matrix = self.load_vector_store()
-        else:
-            with open(os.path.join(VECTOR_STORE_DIR, 'tfidf_matrix.pkl'), 'rb') as f:
-                tfidf_matrix = pickle.load(f)
+        return self.search_documents_batch([query], k=k, filename=filename)[0]
+    
+    def search_documents_batch(self, queries: List[str], k: int = 5, filename: Optional[str] = None) -> List[List[Dict]]:
+        """Search for relevant document chunks for several queries in one pass over the index.
         
-        # Transform query
-        query_vector = self.vectorizer.transform([query])
+        With filename set, only that document's chunks are scored, and a collapsed chunk
+        reports the metadata of its copy in that document.
+        """
+        self.ensure_index()
+        rows = self.file_rows(filename) if filename is not None else None
+        increment('search.queries', len(queries))
         
-        # Calculate similarities
-        similarities = cosine_similarity(query_vector, tfidf_matrix).flatten()
+        with span('search.score'):
+            if self.engine == 'bm25':
+                if rows is None:
+                    ranked = self.bm25_index.search_batch(queries, k)
+                else:
+                    ranked = [self.bm25_index.search_rows(query, rows, k) for query in queries]
+            elif self.engine == 'dense':
+                with span('search.transform'):
+                    query_vectors = self.dense_index.project(self.vectorizer.transform(queries))
+                ranked = self.dense_index.search_batch(query_vectors, k, rows)
+            else:
+                ranked = self._rank_tfidf(queries, k, rows)
         
-        # Get top k results
-        top_indices = np.argsort(similarities)[::-1][:k]
+        # Decode only the returned chunks from the chunk store
+        with span('search.fetch'):
+            return [[{
+                'row': int(idx),
+                'content': self.document_chunks[idx],
+                'metadata': self.chunk_metadata[idx] if filename is None else reference_for(self.chunk_metadata[idx], filename),
+                'similarity': float(score)
+            } for idx, score in ranking] for ranking in ranked]
+    
+    def _rank_tfidf(self, queries: List[str], k: int, rows: Optional[np.ndarray] = None) -> List[List]:
+        """Rank chunks by TF-IDF cosine similarity, returning (index, score) pairs per query"""
+        # Transform all queries together
+        with span('search.transform'):
+            query_matrix = self.vectorizer.transform(queries)
         
-        results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Only include relevant results
-                results.append({
-                    'content': self.document_chunks[idx],
-                    'metadata': self.chunk_metadata[idx],
-                    'similarity': float(similarities[idx])
-                })
+        # Rows are L2-normalised by the vectorizer, so one sparse product gives all cosine similarities
+        matrix = self.tfidf_matrix if rows is None else self.tfidf_matrix[rows]
+        similarities = (query_matrix @ matrix.T).tocsr()
         
-        return results
+        ranked = []
+        for row in range(similarities.shape[0]):
+            start, end = similarities.indptr[row], similarities.indptr[row + 1]
+            scores = similarities.data[start:end]
+            indices = similarities.indices[start:end]
+            if rows is not None:
+                indices = rows[indices]
+            
+            # Only chunks sharing a term with the query can be relevant
+            ranked.append([(int(indices[pos]), scores[pos]) for pos in top_k_indices(scores, k) if scores[pos] > 0])
+        
+        return ranked
+
+def ingest_file(filename: str):
+    """Process one file, returning (filename, chunks, metadata, error); runs in worker processes"""
+    try:
+        chunks, metadata = PDFProcessor().process_file(filename)
+        return filename, chunks, metadata, None
+    except Exception as e:
+        return filename, [], [], str(e)
+
+def ingest_file_with_metrics(filename: str):
+    """ingest_file for worker processes, also returning the worker's spans for this file"""
+    METRICS.reset()
+    return ingest_file(filename), METRICS.snapshot()
 
 if __name__ == "__main__":
+    import sys
+    
     processor = PDFProcessor()
-    result = processor.process_documents()
-    print(f"Processing complete: {result}")
-    processor.create_vector_store()
-    print("Vector store created successfully!")
\ No newline at end of file
+    if '--incremental' in sys.argv:
+        result = processor.update_vector_store()
+        print(f"Incremental update complete: {result}")
+    else:
+        result = processor.process_documents()
+        print(f"Processing complete: {result}")
+        processor.create_vector_store()
+        print("Vector store created successfully!")
\ No newline at end of file
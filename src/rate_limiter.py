@@ -0,0 +1,74 @@
+import time
+import random
+import threading
+from typing import Callable
+from config import LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
+from instrumentation import span, increment
+
+# Exception class names backends raise when a quota or capacity limit is hit
+QUOTA_ERRORS = ('ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'QuotaExceededError')
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for rate limiting (about four characters per token)"""
+    return len(text) // 4 + 1
+
+def is_quota_error(error: Exception) -> bool:
+    """Whether an API error is a rate/quota limit worth retrying"""
+    if type(error).__name__ in QUOTA_ERRORS:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'rate limit' in message
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1.0):
+        """Block until amount tokens are available, then take them"""
+        # A request larger than the bucket would wait forever; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by all worker threads"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def acquire(self, tokens: int):
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+def call_with_backoff(fn: Callable, max_retries: int = LLM_MAX_RETRIES,
+                      base_delay: float = LLM_BACKOFF_BASE, max_delay: float = LLM_BACKOFF_MAX):
+    """Call fn, retrying quota errors with jittered exponential backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not is_quota_error(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Rate limited ({type(e).__name__}), retrying in {delay:.1f}s...")
+            increment('llm.retries')
+            with span('llm.backoff'):
+                time.sleep(delay)
@@ -0,0 +1,428 @@
+import re
+import heapq
+from collections import Counter
+from functools import lru_cache
+from typing import List, Sequence, Tuple, Dict
+import numpy as np
+from config import (BM25_K1, BM25_B, HASHING_FEATURES, DENSE_DIMENSIONS, DENSE_IVF_LISTS, DENSE_IVF_PROBES,
+                    DENSE_REFIT_FRACTION)
+from store_format import save_array, load_array, save_json, load_json
+
+# Retrieval engines selectable through RETRIEVAL_ENGINE in config.py
+RETRIEVAL_ENGINES = ('tfidf', 'bm25', 'dense')
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+@lru_cache(maxsize=None)
+def stop_words() -> frozenset:
+    """English stop words of the TF-IDF analyzer; scikit-learn is imported on first use"""
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return ENGLISH_STOP_WORDS
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k largest scores in descending order without a full sort"""
+    if k <= 0 or len(scores) == 0:
+        return np.array([], dtype=int)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split into words and drop English stop words (matches the TF-IDF analyzer)"""
+    stop = stop_words()
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in stop]
+
+class BM25Index:
+    """Inverted index with BM25 scoring and MaxScore early-terminating top-k retrieval.
+
+    Postings are stored term-major in flat arrays: the postings of term t are
+    doc_ids[offsets[t]:offsets[t + 1]] (ascending) with matching term frequencies in tfs.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.int32)
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.max_scores = np.zeros(0, dtype=np.float32)
+        self.avg_doc_length = 0.0
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_lengths)
+
+    def build(self, documents: List[str]):
+        """Build the inverted index from a list of documents"""
+        postings = {}
+        doc_lengths = []
+
+        for doc_id, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+
+        lengths = [len(postings[term]) for term in terms]
+        self.offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(lengths)
+        self.doc_ids = np.fromiter((doc_id for term in terms for doc_id, _ in postings[term]),
+                                   dtype=np.int32, count=int(self.offsets[-1]))
+        self.tfs = np.fromiter((tf for term in terms for _, tf in postings[term]),
+                               dtype=np.int32, count=int(self.offsets[-1]))
+        self.doc_lengths = np.array(doc_lengths, dtype=np.int32)
+        self._compute_statistics()
+        return self
+
+    def _compute_statistics(self):
+        """Compute IDF and per-term score upper bounds used for early termination"""
+        n = self.num_docs
+        self.avg_doc_length = float(self.doc_lengths.mean()) if n else 0.0
+        df = np.diff(self.offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        self.max_scores = np.zeros(len(df), dtype=np.float32)
+        if len(self.doc_ids):
+            term_of_posting = np.repeat(np.arange(len(df)), np.diff(self.offsets))
+            scores = self._posting_scores(self.tfs, self.doc_ids, self.idf[term_of_posting])
+            np.maximum.at(self.max_scores, term_of_posting, scores.astype(np.float32))
+
+    def _posting_scores(self, tfs, doc_ids, idf):
+        """BM25 contribution of postings with the given term frequencies"""
+        avg = self.avg_doc_length or 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_ids] / avg)
+        return idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+    def _score(self, term_id: int, position: int) -> float:
+        doc_id = self.doc_ids[position]
+        tf = float(self.tfs[position])
+        avg = self.avg_doc_length or 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_id] / avg)
+        return float(self.idf[term_id]) * tf * (self.k1 + 1.0) / (tf + norm)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Return the top k (doc id, score) pairs for a query using MaxScore pruning"""
+        query_terms = Counter(term for term in tokenize(query) if term in self.vocabulary)
+        if not query_terms or k <= 0:
+            return []
+
+        # Terms ordered by ascending upper bound; a prefix of them is "non-essential"
+        # once their combined upper bound can no longer lift a document into the top k
+        terms = []
+        for term, qtf in query_terms.items():
+            term_id = self.vocabulary[term]
+            terms.append((float(self.max_scores[term_id]) * qtf, term_id, qtf))
+        terms.sort()
+        upper_bounds = [ub for ub, _, _ in terms]
+        cumulative = list(np.cumsum(upper_bounds))
+
+        starts = [int(self.offsets[term_id]) for _, term_id, _ in terms]
+        ends = [int(self.offsets[term_id + 1]) for _, term_id, _ in terms]
+        positions = list(starts)
+
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+
+        while True:
+            # Next candidate is the smallest current document among essential terms
+            candidate = None
+            for i in range(first_essential, len(terms)):
+                if positions[i] < ends[i]:
+                    doc_id = int(self.doc_ids[positions[i]])
+                    if candidate is None or doc_id < candidate:
+                        candidate = doc_id
+            if candidate is None:
+                break
+
+            score = 0.0
+            for i in range(first_essential, len(terms)):
+                if positions[i] < ends[i] and self.doc_ids[positions[i]] == candidate:
+                    score += self._score(terms[i][1], positions[i]) * terms[i][2]
+                    positions[i] += 1
+
+            # Probe non-essential terms from the highest bound down, stopping once hopeless
+            for i in range(first_essential - 1, -1, -1):
+                if score + cumulative[i] <= threshold:
+                    break
+                position = starts[i] + int(np.searchsorted(self.doc_ids[starts[i]:ends[i]], candidate))
+                if position < ends[i] and self.doc_ids[position] == candidate:
+                    score += self._score(terms[i][1], position) * terms[i][2]
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -candidate))
+            else:
+                continue
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and cumulative[first_essential] <= threshold:
+                    first_essential += 1
+
+        return [(-neg_doc, score) for score, neg_doc in sorted(heap, reverse=True)]
+
+    def search_rows(self, query: str, rows: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """Score only the given documents (e.g. one contract's chunks) by probing each posting list"""
+        rows = np.sort(np.asarray(rows, dtype=np.int64))
+        scores = np.zeros(len(rows), dtype=np.float64)
+
+        for term, qtf in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            postings = self.doc_ids[start:end]
+            positions = np.searchsorted(postings, rows)
+            found = positions < len(postings)
+            found[found] = postings[positions[found]] == rows[found]
+            if found.any():
+                hits = start + positions[found]
+                scores[found] += qtf * self._posting_scores(self.tfs[hits], self.doc_ids[hits], self.idf[term_id])
+
+        order = [i for i in np.argsort(-scores, kind='stable')[:k] if scores[i] > 0]
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def search_batch(self, queries: List[str], k: int = 5) -> List[List[Tuple[int, float]]]:
+        """Run several queries against the index"""
+        return [self.search(query, k) for query in queries]
+
+    def save(self, store_dir: str) -> Dict:
+        """Write the postings as raw arrays, returning the parameters to record in the store info"""
+        for name in ('offsets', 'doc_ids', 'tfs', 'doc_lengths', 'idf', 'max_scores'):
+            save_array(store_dir, f'bm25_{name}', getattr(self, name))
+        save_json(store_dir, 'bm25_vocabulary.json', self.vocabulary)
+        return {'k1': self.k1, 'b': self.b, 'avg_doc_length': self.avg_doc_length}
+
+    @classmethod
+    def load(cls, store_dir: str, info: Dict) -> 'BM25Index':
+        """Open a saved index with its postings memory-mapped"""
+        index = cls(k1=info['k1'], b=info['b'])
+        for name in ('offsets', 'doc_ids', 'tfs', 'doc_lengths', 'idf', 'max_scores'):
+            setattr(index, name, load_array(store_dir, f'bm25_{name}'))
+        index.vocabulary = load_json(store_dir, 'bm25_vocabulary.json')
+        index.avg_doc_length = info['avg_doc_length']
+        return index
+
+class IncrementalTfidfVectorizer:
+    """TF-IDF over a hashed feature space whose IDF is maintained as chunks are added or removed.
+
+    The hashed vocabulary never has to be refitted, so an update only tokenizes the new
+    chunks; existing rows are re-weighted from their stored raw counts.
+    """
+
+    def __init__(self, n_features: int = HASHING_FEATURES):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            stop_words='english',
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None
+        )
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.num_documents = 0
+        self.idf_ = np.ones(n_features, dtype=np.float64)
+
+    def count(self, documents: List[str]):
+        """Return the raw term counts of documents in the hashed feature space"""
+        if not documents:
+            import scipy.sparse as sp
+            return sp.csr_matrix((0, self.n_features), dtype=np.float64)
+        return self.hasher.transform(documents).tocsr()
+
+    def add_counts(self, counts):
+        """Account for newly indexed rows in the document frequencies"""
+        self.document_frequency += np.bincount(counts.indices, minlength=self.n_features)
+        self.num_documents += counts.shape[0]
+        self._update_idf()
+
+    def remove_counts(self, counts):
+        """Account for dropped rows in the document frequencies"""
+        self.document_frequency -= np.bincount(counts.indices, minlength=self.n_features)
+        self.num_documents -= counts.shape[0]
+        self._update_idf()
+
+    def _update_idf(self):
+        # Same smoothed IDF as TfidfVectorizer
+        self.idf_ = np.log((1.0 + self.num_documents) / (1.0 + self.document_frequency)) + 1.0
+
+    def weight(self, counts):
+        """Apply the current IDF to raw counts and L2-normalise the rows"""
+        from sklearn.preprocessing import normalize
+
+        return normalize(counts.multiply(self.idf_).tocsr(), norm='l2', copy=False)
+
+    def fit_transform(self, documents: List[str]):
+        """Index documents from scratch, returning (tfidf matrix, raw counts)"""
+        self.document_frequency[:] = 0
+        self.num_documents = 0
+        counts = self.count(documents)
+        self.add_counts(counts)
+        return self.weight(counts), counts
+
+    def transform(self, documents: List[str]):
+        """Vectorize queries against the current IDF"""
+        return self.weight(self.count(documents))
+
+    def save(self, store_dir: str) -> Dict:
+        """Write the document frequencies, returning the parameters to record in the store info"""
+        save_array(store_dir, 'document_frequency', self.document_frequency)
+        return {'type': 'hashed', 'n_features': self.n_features, 'num_documents': self.num_documents}
+
+    @classmethod
+    def load(cls, store_dir: str, info: Dict) -> 'IncrementalTfidfVectorizer':
+        """Restore a vectorizer; frequencies are copied into memory since updates modify them"""
+        vectorizer = cls(n_features=info['n_features'])
+        vectorizer.document_frequency = load_array(store_dir, 'document_frequency', mmap=False)
+        vectorizer.num_documents = info['num_documents']
+        vectorizer._update_idf()
+        return vectorizer
+
+class DenseIndex:
+    """LSA embeddings of the TF-IDF rows behind an inverted-file (IVF) nearest-neighbour index.
+
+    Truncated SVD projects the TF-IDF matrix to a few hundred dimensions; rows are stored as
+    L2-normalised float32 embeddings, so a dot product is a cosine similarity. k-means splits
+    the embeddings into lists, and a query scores only the rows of the nprobe lists whose
+    centroids are closest to it: the rows of list l are list_rows[list_offsets[l]:list_offsets[l + 1]].
+
+    Incremental updates reuse the fitted projection and centroids, embedding only the added
+    rows, until the rows added since the fit exceed DENSE_REFIT_FRACTION of the rows fitted on.
+    """
+
+    def __init__(self, dimensions: int = DENSE_DIMENSIONS, lists: int = DENSE_IVF_LISTS,
+                 nprobe: int = DENSE_IVF_PROBES):
+        self.dimensions = dimensions
+        self.lists = lists
+        self.nprobe = nprobe
+        self.fitted_rows = 0
+        self.added_rows = 0
+        self.components = np.zeros((0, 0), dtype=np.float32)
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+        self.list_rows = np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def build(self, tfidf_matrix):
+        """Fit the projection on the TF-IDF matrix and cluster the embeddings"""
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.cluster import MiniBatchKMeans
+
+        num_rows, num_features = tfidf_matrix.shape
+        self.dimensions = max(1, min(self.dimensions, num_rows - 1, num_features - 1))
+        svd = TruncatedSVD(n_components=self.dimensions, random_state=0)
+        self.embeddings = self._normalize(svd.fit_transform(tfidf_matrix))
+        self.components = svd.components_.astype(np.float32)
+
+        # About 4 * sqrt(n) lists keeps both the centroid scan and each probed list short
+        self.lists = max(1, min(self.lists or int(4 * np.sqrt(num_rows)), num_rows))
+        if self.lists > 1:
+            kmeans = MiniBatchKMeans(n_clusters=self.lists, random_state=0, n_init=3,
+                                     batch_size=max(1024, 3 * self.lists))
+            assignments = kmeans.fit_predict(self.embeddings)
+            self.centroids = self._normalize(kmeans.cluster_centers_)
+        else:
+            assignments = np.zeros(num_rows, dtype=np.int64)
+            self.centroids = self._normalize(self.embeddings.mean(axis=0, keepdims=True))
+
+        self._set_lists(assignments)
+        self.fitted_rows = num_rows
+        self.added_rows = 0
+        return self
+
+    def _set_lists(self, assignments: np.ndarray):
+        """Group rows by their list number"""
+        self.list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.list_offsets = np.zeros(self.lists + 1, dtype=np.int64)
+        self.list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=self.lists))
+
+    def needs_refit(self, new_rows: int) -> bool:
+        """Whether adding new_rows more rows should refit the projection and lists"""
+        return self.added_rows + new_rows > DENSE_REFIT_FRACTION * self.fitted_rows
+
+    def updated(self, kept_rows: Sequence[int], tfidf_matrix, columns: np.ndarray) -> 'DenseIndex':
+        """Index for a store keeping kept_rows (in order) followed by the rows of tfidf_matrix past them.
+
+        Kept rows keep their embeddings and lists; added rows are projected with the fitted
+        components and assigned to their nearest centroid. columns gives, for each feature of
+        tfidf_matrix, its column in the fitted projection (-1 for terms it was not fitted on).
+        """
+        kept_rows = np.asarray(kept_rows, dtype=np.int64)
+        components = np.zeros((self.components.shape[0], len(columns)), dtype=np.float32)
+        known = columns >= 0
+        components[:, known] = self.components[:, columns[known]]
+        added = self._normalize(np.asarray(tfidf_matrix[len(kept_rows):] @ components.T))
+
+        # List of every stored row, from the rows grouped per list
+        assignments = np.empty(len(self.list_rows), dtype=np.int64)
+        assignments[self.list_rows] = np.repeat(np.arange(self.lists), np.diff(self.list_offsets))
+        added_assignments = np.argmax(added @ self.centroids.T, axis=1) if len(added) else np.zeros(0, dtype=np.int64)
+
+        index = DenseIndex(self.dimensions, self.lists, self.nprobe)
+        index.components = components
+        index.embeddings = np.vstack([np.asarray(self.embeddings[kept_rows]), added]).astype(np.float32)
+        index.centroids = np.asarray(self.centroids)
+        index._set_lists(np.concatenate([assignments[kept_rows], added_assignments]))
+        index.fitted_rows = self.fitted_rows
+        index.added_rows = self.added_rows + len(added)
+        return index
+
+    def project(self, query_matrix) -> np.ndarray:
+        """Embed TF-IDF query vectors in the LSA space"""
+        return self._normalize(np.asarray(query_matrix @ self.components.T))
+
+    def search_batch(self, query_vectors: np.ndarray, k: int = 5,
+                     rows: np.ndarray = None) -> List[List[Tuple[int, float]]]:
+        """Top-k rows per embedded query: over the probed lists, or exactly over the given rows"""
+        ranked = []
+        if rows is not None:
+            scores = query_vectors @ self.embeddings[rows].T
+            for query_scores in scores:
+                ranked.append([(int(rows[i]), float(query_scores[i])) for i in top_k_indices(query_scores, k)
+                               if query_scores[i] > 0])
+            return ranked
+
+        centroid_scores = query_vectors @ self.centroids.T
+        for query_vector, list_scores in zip(query_vectors, centroid_scores):
+            probes = top_k_indices(list_scores, self.nprobe)
+            candidates = np.concatenate([self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]]
+                                         for l in probes])
+            scores = self.embeddings[candidates] @ query_vector
+            ranked.append([(int(candidates[i]), float(scores[i])) for i in top_k_indices(scores, k)
+                           if scores[i] > 0])
+        return ranked
+
+    def save(self, store_dir: str) -> Dict:
+        """Write the projection, embeddings and lists, returning the parameters to record in the store info"""
+        for name in ('components', 'embeddings', 'centroids', 'list_offsets', 'list_rows'):
+            save_array(store_dir, f'dense_{name}', getattr(self, name))
+        return {'dimensions': self.dimensions, 'lists': self.lists, 'fitted_rows': self.fitted_rows,
+                'added_rows': self.added_rows}
+
+    @classmethod
+    def load(cls, store_dir: str, info: Dict, nprobe: int = DENSE_IVF_PROBES) -> 'DenseIndex':
+        """Open a saved index with its embeddings memory-mapped"""
+        index = cls(dimensions=info['dimensions'], lists=info['lists'], nprobe=nprobe)
+        for name in ('components', 'embeddings', 'centroids', 'list_offsets', 'list_rows'):
+            setattr(index, name, load_array(store_dir, f'dense_{name}'))
+        index.fitted_rows = info.get('fitted_rows', len(index.embeddings))
+        index.added_rows = info.get('added_rows', 0)
+        return index
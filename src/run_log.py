@@ -0,0 +1,117 @@
+import os
+import json
+import uuid
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from config import RUN_LOG_FILE, RUN_LOG_MAX_RUNS
+from instrumentation import span
+
+# Append-only JSONL log of compliance runs. Every line is one event tagged with its run id:
+#   {"run_id": ..., "event": "start", "kind": "check" | "matrix", "started": ..., "context": {...}, ...}
+#   {"run_id": ..., "event": "result", "rule_id": ..., "filename": ... | null, "result": {...}}
+#   {"run_id": ..., "event": "complete", "finished": ...}
+# Each line is flushed and fsynced as soon as it is written, so a crash loses at most the
+# result being written, and a run without a "complete" event can be resumed as long as its
+# context (the index and rules its results were produced from) is unchanged.
+
+class RunLog:
+    """Crash-safe, append-only log of rule results grouped into runs"""
+
+    def __init__(self, path: str = RUN_LOG_FILE, max_runs: int = RUN_LOG_MAX_RUNS):
+        self.path = path
+        self.max_runs = max_runs
+        self.run_id = None
+        self.lock = threading.Lock()
+
+    def read_events(self) -> List[Dict]:
+        """All events in the log, skipping a partially written last line"""
+        events = []
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return events
+
+    def runs(self) -> List[Dict]:
+        """Start events of every logged run, oldest first, with a 'complete' flag"""
+        runs = {}
+        for event in self.read_events():
+            if event['event'] == 'start':
+                runs[event['run_id']] = dict(event, complete=False)
+            elif event['event'] == 'complete' and event['run_id'] in runs:
+                runs[event['run_id']]['complete'] = True
+        return list(runs.values())
+
+    def latest_run(self, kind: Optional[str] = None) -> Optional[Dict]:
+        """The most recently started run, optionally of one kind"""
+        runs = [run for run in self.runs() if kind is None or run['kind'] == kind]
+        return runs[-1] if runs else None
+
+    def start(self, kind: str, resume: bool = True, context: Optional[Dict] = None, **info) -> str:
+        """Begin a run, or reopen the latest unfinished run of the same kind when resuming.
+
+        A run is only reopened if it was started with an equal context; otherwise its results
+        may cite an index or rules that no longer exist, and a new run is started.
+        """
+        latest = self.latest_run(kind)
+        if resume and latest is not None and not latest['complete']:
+            if latest.get('context') == context:
+                self.run_id = latest['run_id']
+                return self.run_id
+            print(f"Not resuming run {latest['run_id']}: the index or rules changed since it started")
+
+        self._prune()
+        self.run_id = uuid.uuid4().hex
+        self._write({'event': 'start', 'kind': kind, 'started': datetime.now().isoformat(), 'context': context, **info})
+        return self.run_id
+
+    def append(self, rule_id: str, result: Dict, filename: Optional[str] = None):
+        """Record one finished rule result for the current run"""
+        self._write({'event': 'result', 'rule_id': rule_id, 'filename': filename, 'result': result})
+
+    def complete(self):
+        """Mark the current run as finished"""
+        self._write({'event': 'complete', 'finished': datetime.now().isoformat()})
+
+    def results(self, run_id: Optional[str] = None) -> Dict:
+        """Latest result per (filename, rule id) logged for a run (the current one by default)"""
+        run_id = run_id or self.run_id
+        results = {}
+        for event in self.read_events():
+            if event['run_id'] == run_id and event['event'] == 'result':
+                results[(event['filename'], event['rule_id'])] = event['result']
+        return results
+
+    def completed(self, run_id: Optional[str] = None) -> Dict:
+        """Results of a run that do not need to be redone; errors are retried on resume"""
+        return {key: result for key, result in self.results(run_id).items()
+                if result['compliance_status'] != 'ERROR'}
+
+    def _write(self, event: Dict):
+        with self.lock, span('check.write'):
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'run_id': self.run_id, **event}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _prune(self):
+        """Drop the oldest finished runs beyond max_runs so the log does not grow without bound"""
+        runs = self.runs()
+        finished = [run['run_id'] for run in runs if run['complete']]
+        if len(finished) < self.max_runs:
+            return
+
+        drop = set(finished[:len(finished) - self.max_runs + 1])
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                for event in self.read_events():
+                    if event['run_id'] not in drop:
+                        f.write(json.dumps(event) + '\n')
+            os.replace(self.path + '.tmp', self.path)
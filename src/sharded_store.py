@@ -0,0 +1,296 @@
+import os
+import heapq
+import shutil
+import hashlib
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import PDF_DIR, VECTOR_STORE_DIR, RETRIEVAL_ENGINE, NUM_SHARDS, SHARD_WORKERS
+from pdf_processor import PDFProcessor, get_store_version, load_manifest, shard_of
+from retrieval import RETRIEVAL_ENGINES
+from instrumentation import METRICS, span, timed
+
+# A vector store split into independent shards under vector_store/shard_NNN, each indexing the
+# documents whose filename hashes to it. Every shard uses the hashed TF-IDF vectorizer, so all
+# shards share one feature space (a vocabulary that never needs a joint fit) and a shard is
+# built or updated without touching the others. IDF weights are per shard, as in search
+# engines that score with shard-local term statistics.
+#
+# Searches fan out to a pool of worker processes, each keeping the shards it has opened, and the
+# per-shard top-k lists are merged by similarity. Rows are numbered globally by concatenating the
+# shards in order, so a ShardedVectorStore can stand in for a PDFProcessor in the checker.
+
+def shard_dir(index: int, root: str = VECTOR_STORE_DIR) -> str:
+    """Store directory of one shard"""
+    return os.path.join(root, f'shard_{index:03d}')
+
+def open_shard(index: int, num_shards: int, engine: str, root: str = VECTOR_STORE_DIR) -> PDFProcessor:
+    """Processor indexing only the documents of one shard"""
+    return PDFProcessor(engine=engine, store_dir=shard_dir(index, root), shard=(index, num_shards), incremental=True)
+
+def get_sharded_store_version(num_shards: int = NUM_SHARDS, root: str = VECTOR_STORE_DIR) -> Optional[str]:
+    """Version string covering every shard, or None if no shard has been built"""
+    versions = [get_store_version(shard_dir(index, root)) for index in range(num_shards)]
+    if not any(versions):
+        return None
+    return hashlib.sha1('|'.join(str(version) for version in versions).encode('utf-8')).hexdigest()[:16]
+
+# Shards opened by this worker process; each reloads itself when its store changes on disk
+_open_shards = {}
+
+def search_shard(index: int, num_shards: int, engine: str, root: str, queries: List[str], k: int):
+    """Search one shard in a worker process, also returning the worker's spans for the search"""
+    METRICS.reset()
+    key = (root, index, num_shards, engine)
+    if key not in _open_shards:
+        _open_shards[key] = open_shard(index, num_shards, engine, root)
+    return _open_shards[key].search_documents_batch(queries, k), METRICS.snapshot()
+
+def build_shard(index: int, num_shards: int, engine: str, root: str) -> int:
+    """Build one shard from scratch, returning its chunk count; a shard without documents is removed"""
+    shard = open_shard(index, num_shards, engine, root)
+    if not shard.list_documents():
+        shutil.rmtree(shard.store_dir, ignore_errors=True)
+        return 0
+    shard.create_vector_store()
+    return len(shard.document_chunks)
+
+def update_shard(index: int, num_shards: int, engine: str, root: str) -> Dict:
+    """Re-index the new, changed and deleted documents of one shard"""
+    shard = open_shard(index, num_shards, engine, root)
+    if not shard.list_documents():
+        removed = len(load_manifest(shard.store_dir) or {})
+        shutil.rmtree(shard.store_dir, ignore_errors=True)
+        return {'added': 0, 'changed': 0, 'removed': removed}
+    return shard.update_vector_store()
+
+class ShardedSequence(Sequence):
+    """Read-only concatenation of per-shard sequences, addressed by global row"""
+
+    def __init__(self, parts: List[Sequence], offsets: np.ndarray):
+        self.parts = parts
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        part = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return self.parts[part][index - int(self.offsets[part])]
+
+class ShardedKeywordIndex:
+    """Keyword hit lookups across the shards' keyword indexes, by global row"""
+
+    def __init__(self, store: 'ShardedVectorStore'):
+        self.store = store
+
+    def has_hits(self, rule_id: str, rows: Optional[np.ndarray] = None) -> bool:
+        for position, shard in enumerate(self.store.active_shards()):
+            start, end = self.store.offsets[position], self.store.offsets[position + 1]
+            local = None
+            if rows is not None:
+                local = rows[(rows >= start) & (rows < end)] - start
+                if not len(local):
+                    continue
+            if shard.keyword_index is None or shard.keyword_index.has_hits(rule_id, local):
+                return True
+        return False
+
+    def row_hits(self, rule_id: str, row: int) -> List[Tuple[int, int, str]]:
+        shard, local = self.store.locate(row)
+        return shard.keyword_index.row_hits(rule_id, local) if shard.keyword_index is not None else []
+
+class ShardedVectorStore:
+    """Vector store partitioned by filename hash, searched by parallel fan-out"""
+
+    def __init__(self, num_shards: int = NUM_SHARDS, engine: str = RETRIEVAL_ENGINE,
+                 workers: int = SHARD_WORKERS, root: str = VECTOR_STORE_DIR):
+        if engine not in RETRIEVAL_ENGINES:
+            raise ValueError(f"Unknown retrieval engine '{engine}', expected one of {RETRIEVAL_ENGINES}")
+        if engine == 'dense':
+            # Each shard would hold a DENSE_DIMENSIONS x 2^20 projection of the hashed features
+            raise ValueError("The dense engine cannot be sharded: shards share hashed features; "
+                             "use 'tfidf' or 'bm25', or NUM_SHARDS = 1")
+        self.num_shards = num_shards
+        self.engine = engine
+        self.workers = workers
+        self.root = root
+        self.shards = [open_shard(index, num_shards, engine, root) for index in range(num_shards)]
+        self.active = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.index_version = None
+        self.document_chunks = []
+        self.chunk_metadata = []
+        self.keyword_index = None
+        self.executor = None
+
+    def pool_size(self, tasks: int) -> int:
+        """Worker processes for a number of independent shard tasks"""
+        workers = self.workers or os.cpu_count() or 1
+        return max(1, min(workers, tasks))
+
+    def map_shards(self, fn, indices: List[int]) -> List:
+        """Run fn(index, num_shards, engine, root) for several shards, in parallel when allowed"""
+        arguments = [(index, self.num_shards, self.engine, self.root) for index in indices]
+        workers = self.pool_size(len(indices))
+        if workers == 1:
+            return [fn(*args) for args in arguments]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(fn, *zip(*arguments)))
+
+    def download_cuad_contracts(self):
+        """Create the sample contracts (in the shared PDF directory)"""
+        return self.shards[0].download_cuad_contracts()
+
+    @timed('index.create', export=True)
+    def create_vector_store(self):
+        """Build every shard from scratch"""
+        if not os.path.exists(PDF_DIR) or not os.listdir(PDF_DIR):
+            print("No documents found, creating CUAD contract documents...")
+            self.download_cuad_contracts()
+
+        counts = self.map_shards(build_shard, list(range(self.num_shards)))
+        print(f"Sharded vector store created with {sum(counts)} chunks in "
+              f"{sum(1 for count in counts if count)} of {self.num_shards} shards")
+        return self.load_vector_store()
+
+    @timed('index.update', export=True)
+    def update_vector_store(self) -> Dict:
+        """Update each shard from its own manifest; shards whose documents did not change are untouched"""
+        summaries = self.map_shards(update_shard, list(range(self.num_shards)))
+        summary = {key: sum(shard_summary[key] for shard_summary in summaries) for key in ('added', 'changed', 'removed')}
+        summary['shards_updated'] = [index for index, shard_summary in enumerate(summaries) if any(shard_summary.values())]
+        self.load_vector_store()
+        return summary
+
+    def rebuild_shard(self, index: int) -> int:
+        """Rebuild one shard from scratch, leaving the others as they are"""
+        count = build_shard(index, self.num_shards, self.engine, self.root)
+        self.load_vector_store()
+        return count
+
+    @timed('index.load')
+    def load_vector_store(self):
+        """Open every built shard and number their rows globally"""
+        self.active = [index for index in range(self.num_shards)
+                       if get_store_version(shard_dir(index, self.root)) is not None]
+        if not self.active:
+            print("Sharded vector store not found, creating new one...")
+            return self.create_vector_store()
+
+        for shard in self.active_shards():
+            shard.ensure_index()
+        lengths = [len(shard.document_chunks) for shard in self.active_shards()]
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(lengths)
+
+        self.document_chunks = ShardedSequence([shard.document_chunks for shard in self.active_shards()], self.offsets)
+        self.chunk_metadata = ShardedSequence([shard.chunk_metadata for shard in self.active_shards()], self.offsets)
+        self.keyword_index = ShardedKeywordIndex(self)
+        self.index_version = get_sharded_store_version(self.num_shards, self.root)
+
+    def ensure_index(self):
+        """Reload the shards only if one of them changed on disk"""
+        if self.index_version is None or get_sharded_store_version(self.num_shards, self.root) != self.index_version:
+            self.load_vector_store()
+
+    def active_shards(self) -> List[PDFProcessor]:
+        return [self.shards[index] for index in self.active]
+
+    def locate(self, row: int) -> Tuple[PDFProcessor, int]:
+        """Shard holding a global row, and the row's index within it"""
+        position = int(np.searchsorted(self.offsets, row, side='right')) - 1
+        return self.shards[self.active[position]], row - int(self.offsets[position])
+
+    def indexed_files(self) -> List[str]:
+        """Filenames with chunks in any shard, in global row order"""
+        self.ensure_index()
+        return [filename for shard in self.active_shards() for filename in shard.indexed_files()]
+
+    def file_rows(self, filename: str) -> np.ndarray:
+        """Global rows holding the chunks of one file"""
+        self.ensure_index()
+        index = shard_of(filename, self.num_shards)
+        if index not in self.active:
+            return np.array([], dtype=np.int64)
+        position = self.active.index(index)
+        return self.shards[index].file_rows(filename) + self.offsets[position]
+
+    def search_documents(self, query: str, k: int = 5, filename: Optional[str] = None):
+        """Search for relevant document chunks"""
+        return self.search_documents_batch([query], k=k, filename=filename)[0]
+
+    def search_documents_batch(self, queries: List[str], k: int = 5, filename: Optional[str] = None) -> List[List[Dict]]:
+        """Search every shard for several queries and merge their top-k lists.
+
+        With filename set, only the shard holding that document is searched, in this process.
+        """
+        self.ensure_index()
+        if filename is not None:
+            index = shard_of(filename, self.num_shards)
+            if index not in self.active:
+                return [[] for _ in queries]
+            ranked = self.shards[index].search_documents_batch(queries, k, filename)
+            return [self.globalize(docs, self.active.index(index)) for docs in ranked]
+
+        with span('search.fanout'):
+            if self.pool_size(len(self.active)) == 1:
+                per_shard = [shard.search_documents_batch(queries, k) for shard in self.active_shards()]
+            else:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.pool_size(self.num_shards))
+                futures = [self.executor.submit(search_shard, index, self.num_shards, self.engine, self.root, queries, k)
+                           for index in self.active]
+                per_shard = []
+                for future in futures:
+                    ranked, worker_metrics = future.result()
+                    METRICS.merge(worker_metrics)
+                    per_shard.append(ranked)
+
+        with span('search.merge'):
+            return [heapq.nlargest(k, (doc for position, ranked in enumerate(per_shard)
+                                       for doc in self.globalize(ranked[query], position)),
+                                   key=lambda doc: doc['similarity'])
+                    for query in range(len(queries))]
+
+    def globalize(self, docs: List[Dict], position: int) -> List[Dict]:
+        """Renumber a shard's result rows into the global row space"""
+        return [dict(doc, row=doc['row'] + int(self.offsets[position])) for doc in docs]
+
+    def close(self):
+        """Stop the search worker processes"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+def create_processor(engine: str = RETRIEVAL_ENGINE):
+    """The vector store selected by NUM_SHARDS: sharded, or a single PDFProcessor"""
+    if NUM_SHARDS > 1:
+        return ShardedVectorStore(engine=engine)
+    return PDFProcessor(engine=engine)
+
+def current_store_version() -> Optional[str]:
+    """Version of the vector store selected by NUM_SHARDS"""
+    if NUM_SHARDS > 1:
+        return get_sharded_store_version()
+    return get_store_version()
+
+if __name__ == "__main__":
+    import sys
+
+    store = ShardedVectorStore()
+    if '--rebuild-shard' in sys.argv:
+        index = int(sys.argv[sys.argv.index('--rebuild-shard') + 1])
+        print(f"Shard {index} rebuilt with {store.rebuild_shard(index)} chunks")
+    elif '--incremental' in sys.argv:
+        print(f"Incremental update complete: {store.update_vector_store()}")
+    else:
+        store.create_vector_store()
+    store.close()
@@ -0,0 +1,63 @@
+import os
+import json
+from typing import Dict, List
+import numpy as np
+
+# Pickle-free vector store format: raw .npy arrays opened with mmap_mode='r' plus small JSON files.
+# Every file is written to a temporary name and renamed into place, so a process that has the
+# previous version memory-mapped keeps reading a consistent copy.
+FORMAT_VERSION = 1
+
+def save_array(store_dir: str, name: str, array: np.ndarray):
+    """Atomically write an array to <name>.npy"""
+    path = os.path.join(store_dir, f'{name}.npy')
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+    os.replace(path + '.tmp', path)
+
+def load_array(store_dir: str, name: str, mmap: bool = True) -> np.ndarray:
+    """Open <name>.npy, memory-mapped read-only by default"""
+    return np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+
+def save_json(store_dir: str, name: str, data):
+    """Atomically write a JSON file"""
+    path = os.path.join(store_dir, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+def load_json(store_dir: str, name: str):
+    """Read a JSON file from the store"""
+    with open(os.path.join(store_dir, name), 'r') as f:
+        return json.load(f)
+
+def save_csr(store_dir: str, prefix: str, matrix) -> List[int]:
+    """Write a sparse matrix as its CSR data/indices/indptr arrays, returning its shape"""
+    import scipy.sparse as sp
+
+    matrix = sp.csr_matrix(matrix)
+    save_array(store_dir, f'{prefix}_data', matrix.data)
+    save_array(store_dir, f'{prefix}_indices', matrix.indices)
+    save_array(store_dir, f'{prefix}_indptr', matrix.indptr)
+    return list(matrix.shape)
+
+def load_csr(store_dir: str, prefix: str, shape: List[int]):
+    """Open a CSR matrix whose arrays stay memory-mapped"""
+    import scipy.sparse as sp
+
+    return sp.csr_matrix((
+        load_array(store_dir, f'{prefix}_data'),
+        load_array(store_dir, f'{prefix}_indices'),
+        load_array(store_dir, f'{prefix}_indptr')
+    ), shape=tuple(shape), copy=False)
+
+def remove_files(store_dir: str, names: List[str]):
+    """Delete store files that are no longer part of the current layout"""
+    for name in names:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def build_info(**fields) -> Dict:
+    """Describe a store build; written last, so its presence marks a complete store"""
+    return dict(format_version=FORMAT_VERSION, **fields)
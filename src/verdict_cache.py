@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from config import (VERDICT_CACHE_FILE, VERDICT_CACHE_ENABLED, VERDICT_CACHE_MAX_ENTRIES,
+                    VERDICT_CACHE_MAX_AGE_DAYS)
+from instrumentation import span, increment
+
+def make_cache_key(model: str, template_version: str, rule_id: str, rule_data: Dict, contents: List[str]) -> str:
+    """Content address of an LLM verdict: identical inputs always map to the same key"""
+    payload = json.dumps({
+        'model': model,
+        'template': template_version,
+        'rule_id': rule_id,
+        'rule': rule_data,
+        'contents': [hashlib.sha256(content.encode('utf-8')).hexdigest() for content in contents]
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class VerdictCache:
+    """SQLite-backed cache of parsed LLM verdicts with age and size based eviction"""
+
+    def __init__(self, path: str = VERDICT_CACHE_FILE, enabled: bool = VERDICT_CACHE_ENABLED,
+                 max_entries: int = VERDICT_CACHE_MAX_ENTRIES, max_age_days: float = VERDICT_CACHE_MAX_AGE_DAYS):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+
+        if enabled:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS verdicts ('
+                'key TEXT PRIMARY KEY, verdict TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            self.conn.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached verdict for key, or None on a miss"""
+        return self.get_any([key])
+
+    def get_any(self, keys: List[str]) -> Optional[Dict]:
+        """Return the verdict stored under the first present key, counting one hit or miss"""
+        if not self.enabled:
+            return None
+
+        with self.lock, span('cache.lookup'):
+            now = time.time()
+            for key in keys:
+                row = self.conn.execute(
+                    'SELECT verdict, created FROM verdicts WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.max_age:
+                    self.conn.execute('UPDATE verdicts SET last_used = ? WHERE key = ?', (now, key))
+                    self.conn.commit()
+                    self.hits += 1
+                    increment('cache.hits')
+                    return json.loads(row[0])
+
+            self.misses += 1
+            increment('cache.misses')
+            return None
+
+    def put(self, key: str, verdict: Dict):
+        """Store a verdict"""
+        if not self.enabled:
+            return
+
+        with self.lock, span('cache.put'):
+            now = time.time()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO verdicts (key, verdict, created, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(verdict), now, now)
+            )
+            self.conn.commit()
+
+    def evict(self) -> int:
+        """Drop expired entries and the least recently used ones beyond max_entries"""
+        if not self.enabled:
+            return 0
+
+        with self.lock:
+            cursor = self.conn.execute('DELETE FROM verdicts WHERE created < ?', (time.time() - self.max_age,))
+            removed = cursor.rowcount
+            cursor = self.conn.execute(
+                'DELETE FROM verdicts WHERE key IN ('
+                'SELECT key FROM verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+            )
+            removed += cursor.rowcount
+            self.conn.commit()
+            return removed
+
+    def clear(self):
+        """Remove every cached verdict"""
+        if self.enabled:
+            with self.lock:
+                self.conn.execute('DELETE FROM verdicts')
+                self.conn.commit()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process and the number of stored verdicts"""
+        entries = 0
+        if self.enabled:
+            with self.lock:
+                entries = self.conn.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+        return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses, 'entries': entries}